@@ -1,15 +1,31 @@
-import os
-import sqlite3
-import random
-import datetime
-import textwrap
-import matplotlib.pyplot as plt
-import requests
+# Аннотации обработчиков не вычисляются при импорте: библиотека telegram загружается
+# только при сборке бота, после того как приём MQTT уже запущен
+from __future__ import annotations
+
+import asyncio
 import paho.mqtt.client as mqtt
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes
 from threading import Thread
 import time
+from typing import TYPE_CHECKING
+from ingest import IngestWriter
+from sensor_store import SqliteSensorStore, AsyncSensorStore
+from file_store import ColumnarFileStore
+import schema
+import rollups
+import render
+from chart_cache import ChartCache, ChartEntry, DataVersions
+import delivery
+import weather
+import metrics
+from windows import LatestWindows
+from detection import StreamingDetector
+from topics import TopicRouter, BATCH
+from retention import RetentionEngine
+import payload
+
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
 SENSOR_COLORS = {
     'tempC': 'red',
@@ -19,206 +35,360 @@ SENSOR_COLORS = {
 
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
+# Старые топики без device_id, показания с них относятся к schema.DEFAULT_DEVICE
 TOPICS = {
     "tempC": "sensors/temperature",
     "Humidity": "sensors/humidity",
     "q": "sensors/thermal"
 }
+# Топики вида sensors/<device_id>/<metric>
+METRICS = {
+    "temperature": "tempC",
+    "humidity": "Humidity",
+    "thermal": "q"
+}
+SENSORS = ['tempC', 'Humidity', 'q']
 
+# Хранилище показаний: "sqlite" (DB_FILE) или "columnar" (файлы в COLUMNAR_STORE_DIR, file_store.py)
+STORE_BACKEND = "sqlite"
 DB_FILE = 'sensor_data.db'
+DB_READ_POOL_SIZE = 4
+DB_CACHE_SIZE_KIB = 16384
+COLUMNAR_STORE_DIR = 'store'
 ADMIN_CHAT_ID = None
 
 SPIKE_THRESHOLD = 2.0
+INTERNAL_SPIKE_THRESHOLD = 10.0
+EXTERNAL_MARGIN = 5.0
+
+INGEST_BATCH_SIZE = 500
+INGEST_FLUSH_INTERVAL_MS = 1000
+INGEST_MAX_QUEUE = 10000
+INGEST_OVERFLOW = "drop_oldest"
+
+RENDER_WORKERS = None
+
+RENDERER = render.RenderService(max_workers=RENDER_WORKERS)
+
+# Кэш графиков за период: ключ — устройство, датчик, период, окно времени
+# CHART_CACHE_ALIGN секунд и версия данных ряда
+CHART_CACHE_MAX_ENTRIES = 128
+CHART_CACHE_MAX_BYTES = 32 * 1024 * 1024
+CHART_CACHE_ALIGN = 60
+
+CHARTS = ChartCache(max_entries=CHART_CACHE_MAX_ENTRIES, max_bytes=CHART_CACHE_MAX_BYTES)
+DATA_VERSIONS = DataVersions()
+
+TELEGRAM_MESSAGES_PER_SECOND = 30
+TELEGRAM_CHAT_INTERVAL = 1.0
+ALERT_SEND_CONCURRENCY = 20
+
+# Получение обновлений: "polling" или "webhook" (локальный HTTP-сервер за обратным прокси)
+BOT_MODE = "polling"
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+WEBHOOK_URL = None  # публичный адрес, например "https://example.org/telegram"
+WEBHOOK_SECRET = None
+# Обновления разных чатов обрабатываются параллельно, одного чата — по порядку
+UPDATE_CONCURRENCY = 64
+UPDATE_MAX_PENDING = 10000
+# Устройств на одной странице меню выбора (у Telegram ограничено число кнопок клавиатуры)
+DEVICE_MENU_PAGE_SIZE = 8
+
+# Создаётся в create_update_processor при сборке бота
+UPDATES = None
+
+WEATHER_URL = weather.OPEN_METEO_URL
+WEATHER_TTL = 600
+NOVOSIBIRSK_LATITUDE = 55.0084
+NOVOSIBIRSK_LONGITUDE = 82.9357
+
+WEATHER = weather.WeatherProvider(base_url=WEATHER_URL, ttl=WEATHER_TTL)
+
+# Метрики в формате Prometheus: http://METRICS_LISTEN:METRICS_PORT/metrics
+METRICS_ENABLED = True
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9108
+
+METRICS_SERVER = metrics.MetricsServer(METRICS_LISTEN, METRICS_PORT)
+
+LATEST_WINDOW_SIZE = 64
+
+LATEST = LatestWindows(size=LATEST_WINDOW_SIZE)
+
+# Сырые показания старше RETENTION_RAW_DAYS дней переносятся в ARCHIVE_DIR (retention.py)
+ARCHIVE_DIR = 'archive'
+RETENTION_RAW_DAYS = 30
+RETENTION_BATCH_ROWS = 2000
+RETENTION_INTERVAL = 3600
+
+RETENTION = RetentionEngine(
+    DB_FILE,
+    ARCHIVE_DIR,
+    raw_days=RETENTION_RAW_DAYS,
+    batch_rows=RETENTION_BATCH_ROWS,
+    interval=RETENTION_INTERVAL
+)
+
+def create_store(backend):
+    if backend == "sqlite":
+        return SqliteSensorStore(DB_FILE, read_pool_size=DB_READ_POOL_SIZE,
+                                 cache_size_kib=DB_CACHE_SIZE_KIB, retention=RETENTION)
+    if backend == "columnar":
+        return ColumnarFileStore(COLUMNAR_STORE_DIR)
+    raise ValueError(f"Неизвестное хранилище показаний: {backend}")
+
+STORE = create_store(STORE_BACKEND)
+# Обработчики бота обращаются к хранилищу только через DB, не блокируя цикл событий
+DB = AsyncSensorStore(STORE, max_workers=DB_READ_POOL_SIZE)
+
+DETECTION_THRESHOLDS = {
+    'tempC': INTERNAL_SPIKE_THRESHOLD,
+    'q': SPIKE_THRESHOLD
+}
+DETECTION_ALPHA = 0.2
+DETECTION_Z_THRESHOLD = 3.0
+ALERT_COOLDOWN = 300
+
+DETECTOR = StreamingDetector(
+    DETECTION_THRESHOLDS,
+    alpha=DETECTION_ALPHA,
+    z_threshold=DETECTION_Z_THRESHOLD,
+    cooldown=ALERT_COOLDOWN
+)
+
+DELIVERY_LIMITER = delivery.RateLimiter(
+    per_second=TELEGRAM_MESSAGES_PER_SECOND,
+    chat_interval=TELEGRAM_CHAT_INTERVAL
+)
 
 class MQTTClientHandler:
-    def __init__(self):
+    def __init__(self, writer=None, window=None, detector=None, router=None, clock=None):
+        self.router = router or TopicRouter(METRICS, TOPICS, schema.DEFAULT_DEVICE)
+        self.window = window or LATEST
+        self.detector = detector or DETECTOR
+        self.sequences = payload.SequenceTracker()
+        # Источник меток времени показаний; backfill.py при воспроизведении подставляет записанное время
+        self.clock = clock or time.time
+        self.writer = writer or IngestWriter(
+            STORE,
+            batch_size=INGEST_BATCH_SIZE,
+            flush_interval_ms=INGEST_FLUSH_INTERVAL_MS,
+            max_queue=INGEST_MAX_QUEUE,
+            overflow=INGEST_OVERFLOW,
+            versions=DATA_VERSIONS
+        )
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self._loop_thread = None
+        self._stopping = False
 
     def on_connect(self, client, userdata, flags, rc):
         print("Connected to MQTT Broker")
-        for topic in TOPICS.values():
+        for topic in self.router.subscriptions():
             client.subscribe(topic)
             print(f"Subscribed to: {topic}")
 
     def on_message(self, client, userdata, msg):
-        sensor_type = None
-        for key, topic in TOPICS.items():
-            if msg.topic == topic:
-                sensor_type = key
-                break
-        if sensor_type:
+        route = self.router.resolve(msg.topic)
+        if route:
+            device_id, sensor_type = route
+            if sensor_type == BATCH:
+                self.on_batch(device_id, msg.payload)
+                return
             try:
                 value = float(msg.payload.decode())
-                self.save_to_db(sensor_type, value)
-                print(f"Received {sensor_type}: {value}")
+                ts = int(self.clock())
+                self.window.push(sensor_type, value, ts, device_id)
+                self.detector.observe(sensor_type, value, ts, device_id)
+                self.save_to_db(sensor_type, value, ts, device_id)
+                metrics.MQTT_MESSAGES.inc(kind="text", result="ok")
+                print(f"Received {device_id}/{sensor_type}: {value}")
             except ValueError:
-                print(f"Invalid data for {sensor_type}")
-
-    def save_to_db(self, sensor, value):
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        c.execute(
-            "INSERT INTO sensor_data (sensor, value, timestamp) VALUES (?, ?, ?)",
-            (sensor, value, timestamp)
-        )
-        conn.commit()
-        conn.close()
+                metrics.MQTT_MESSAGES.inc(kind="text", result="invalid")
+                print(f"Invalid data for {device_id}/{sensor_type}")
+        else:
+            metrics.MQTT_MESSAGES.inc(kind="unknown", result="ignored")
+
+    def on_batch(self, device_id, data):
+        try:
+            batch = payload.decode_batch(data)
+        except ValueError as e:
+            metrics.MQTT_MESSAGES.inc(kind="batch", result="invalid")
+            print(f"Invalid batch from {device_id}: {e}")
+            return
+        if not self.sequences.check(device_id, batch.seq, batch.uptime):
+            metrics.MQTT_MESSAGES.inc(kind="batch", result="duplicate")
+            print(f"Duplicate batch {batch.seq} from {device_id}")
+            return
+        ts = int(self.clock())
+        for sensor_type, value in batch.readings:
+            self.window.push(sensor_type, value, ts, device_id)
+            self.detector.observe(sensor_type, value, ts, device_id)
+        with metrics.timed(metrics.INGEST_ENQUEUE_SECONDS):
+            accepted = self.writer.put_many(batch.readings, ts, device_id)
+        metrics.MQTT_MESSAGES.inc(kind="batch", result="ok")
+        if accepted < len(batch.readings):
+            print(f"Очередь записи переполнена, отброшено показаний: {len(batch.readings) - accepted}")
+        print(f"Received {device_id} batch {batch.seq}: {batch.readings}")
+
+    @metrics.timed(metrics.INGEST_ENQUEUE_SECONDS)
+    def save_to_db(self, sensor, value, ts=None, device_id=schema.DEFAULT_DEVICE):
+        if not self.writer.put(sensor, value, ts, device_id):
+            print(f"Очередь записи переполнена, показание {sensor} отброшено")
 
     def start(self):
-        while True:
+        self.writer.start()
+        while not self._stopping:
             try:
                 self.client.connect(MQTT_BROKER, MQTT_PORT)
                 break
             except Exception as e:
                 print("Ошибка подключения к MQTT брокеру:", e)
                 time.sleep(5)
-        Thread(target=self.client.loop_forever, daemon=True).start()
+        if self._stopping:
+            return
+        self._loop_thread = Thread(target=self.client.loop_forever, daemon=True)
+        self._loop_thread.start()
+
+    def stop(self, timeout=10.0):
+        """
+        Останавливает приём: отключается от брокера, дожидается выхода из цикла MQTT,
+        затем IngestWriter дописывает всё, что осталось в очереди. Хранилище после
+        этого можно закрывать.
+        """
+        self._stopping = True
+        self.client.disconnect()
+        if self._loop_thread is not None:
+            self._loop_thread.join(timeout)
+            self._loop_thread = None
+        self.writer.stop(timeout)
 
 def check_and_create_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sensor_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sensor TEXT,
-            value REAL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            chat_id INTEGER PRIMARY KEY
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def get_current_data(sensor):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT value, timestamp FROM sensor_data WHERE sensor=? ORDER BY timestamp DESC LIMIT 1", (sensor,))
-    result = c.fetchone()
-    conn.close()
-    return result
-
-def get_data_period(sensor, start_time, end_time):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        SELECT value, timestamp FROM sensor_data 
-        WHERE sensor=? AND timestamp BETWEEN ? AND ? 
-        ORDER BY timestamp
-    ''', (sensor, start_time, end_time))
-    result = c.fetchall()
-    conn.close()
-    return result
-
-def generate_graph(data, sensor):
-    if not data:
-        return None
-    values = [row[0] for row in data]
-    timestamps = [datetime.datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S") for row in data]
-    plt.figure(figsize=(10, 5))
-    plt.plot(timestamps, values, marker='o', color=SENSOR_COLORS.get(sensor, 'black'))
-    plt.title(f'Изменение показаний {sensor}')
-    plt.xlabel('Время')
-    plt.ylabel('Значение')
-    plt.grid(True)
-    graph_file = f'{sensor}_graph.png'
-    plt.savefig(graph_file)
-    plt.close()
-    print(f"Сохранён график {graph_file} для датчика {sensor}")
-    return graph_file
-
-def generate_alert_graph(sensor, period_minutes, alert_message):
-    end_time = datetime.datetime.now()
-    start_time = end_time - datetime.timedelta(minutes=period_minutes)
-    data = get_data_period(sensor, start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                           end_time.strftime("%Y-%m-%d %H:%M:%S"))
-    if not data:
-        print(f"Нет данных для графика аномалии по {sensor} за последние {period_minutes} минут.")
+    STORE.prepare()
+
+async def get_devices():
+    return await DB.devices()
+
+async def get_chat_device(context: ContextTypes.DEFAULT_TYPE):
+    device_id = context.chat_data.get("device_id")
+    if device_id is None:
+        device_id = default_device(await get_devices())
+    return device_id
+
+def default_device(devices):
+    """
+    Устройство для чата, который его не выбирал: schema.DEFAULT_DEVICE, если оно есть,
+    иначе первое по имени. Не зависит от того, какое устройство прислало показания последним.
+    """
+    if not devices or schema.DEFAULT_DEVICE in devices:
+        return schema.DEFAULT_DEVICE
+    return min(devices)
+
+async def get_current_data(sensor, device_id=schema.DEFAULT_DEVICE):
+    latest = LATEST.latest(sensor, device_id)
+    if latest is not None:
+        return latest
+    return await DB.latest(sensor, device_id)
+
+@metrics.timed(metrics.QUERY_SECONDS, query="period_series")
+async def get_period_series_many(sensors, start_time, end_time, device_id=schema.DEFAULT_DEVICE):
+    """Ряды нескольких датчиков за период одним запросом: словарь датчик -> массив."""
+    start_ts = schema.to_epoch(start_time)
+    end_ts = schema.to_epoch(end_time)
+    resolution = rollups.choose_resolution(end_ts - start_ts)
+    if resolution is None:
+        return await DB.range_many(sensors, start_ts, end_ts, device_id)
+    _, bucket_width = resolution
+    return await DB.aggregate_many(sensors, start_ts, end_ts, bucket_width, device_id)
+
+async def generate_panels(series_by_sensor, title, alerts=None, chart="period", period=""):
+    """
+    Один PNG с графиками всех непустых рядов; alerts — словарь датчик -> текст аннотации.
+    Время построения пишется в RENDER_SECONDS с метками chart и period (минуты).
+    """
+    alerts = alerts or {}
+    panels = [
+        (sensor, series, SENSOR_COLORS.get(sensor, 'black'), alerts.get(sensor))
+        for sensor, series in series_by_sensor.items()
+    ]
+    with metrics.timed(metrics.RENDER_SECONDS, chart=chart, period=period):
+        png = await RENDERER.render(render.render_panels, panels, title)
+    if png:
+        print(f"Построен общий график для датчиков {', '.join(series_by_sensor)}")
+    return png
+
+async def get_period_chart(sensors, minutes, device_id=schema.DEFAULT_DEVICE):
+    """Общий график датчиков за последние minutes минут из кэша CHARTS: ChartEntry или None, если данных нет."""
+    now = int(time.time())
+    versions = tuple(DATA_VERSIONS.get(device_id, sensor) for sensor in sensors)
+    key = (device_id, tuple(sensors), minutes, now // CHART_CACHE_ALIGN, versions)
+
+    async def build():
+        series = await get_period_series_many(sensors, now - minutes * 60, now, device_id)
+        series = {sensor: data for sensor, data in series.items() if len(data)}
+        if not series:
+            return None
+        png = await generate_panels(series, f'Показания {device_id} за период', chart="period", period=minutes)
+        return ChartEntry(png, series) if png else None
+
+    return await CHARTS.get_or_render(key, build)
+
+async def generate_alert_graph(alerts, period_minutes, device_id=schema.DEFAULT_DEVICE):
+    """
+    Общий график с аннотациями перепадов за последние period_minutes минут.
+    alerts — словарь датчик -> текст аннотации; все ряды читаются одним запросом.
+    """
+    end_ts = int(time.time())
+    series = await get_period_series_many(list(alerts), end_ts - period_minutes * 60, end_ts, device_id)
+    if not any(len(data) for data in series.values()):
+        print(f"Нет данных для графика аномалии по {', '.join(alerts)} за последние {period_minutes} минут.")
         return None
-    values = [row[0] for row in data]
-    timestamps = [datetime.datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S") for row in data]
-    plt.figure(figsize=(10, 5))
-    plt.plot(timestamps, values, marker='o', linestyle='-', label=sensor,
-             color=SENSOR_COLORS.get(sensor, 'black'))
-    plt.title(f'Изменение показаний {sensor} с обнаруженным перепадом')
-    plt.xlabel('Время')
-    plt.ylabel('Значение')
-    plt.grid(True)
-    wrapped_message = textwrap.fill(alert_message, width=30)
-    plt.annotate(
-        wrapped_message,
-        xy=(timestamps[-1], values[-1]),
-        xycoords='data',
-        xytext=(-150, 20),
-        textcoords='offset points',
-        arrowprops=dict(facecolor='red', shrink=0.05),
-        fontsize=12,
-        color='red',
-        ha='right'
-    )
-    plt.legend()
-    alert_graph_file = f'{sensor}_alert_graph.png'
-    plt.savefig(alert_graph_file)
-    plt.close()
-    print(f"Сохранён график с аномалией: {alert_graph_file}")
-    return alert_graph_file
-
-def get_weather_novosibirsk():
-    url = "https://api.open-meteo.com/v1/forecast?latitude=55.0084&longitude=82.9357&current_weather=true"
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data["current_weather"]["temperature"]
-    except Exception as e:
-        print("Ошибка получения данных погоды:", e)
-        return 5.0
-
-def check_external_temperature_alert(threshold=SPIKE_THRESHOLD, margin=5.0):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT value FROM sensor_data WHERE sensor='q' ORDER BY timestamp DESC LIMIT 5")
-    rows = c.fetchall()
-    conn.close()
-    if len(rows) < 2:
+    return await generate_panels(series, f'Обнаруженный перепад ({device_id})', alerts,
+                                 chart="alert", period=period_minutes)
+
+@metrics.timed(metrics.WEATHER_SECONDS, call="lookup")
+async def get_weather_novosibirsk():
+    return await WEATHER.get_temperature(NOVOSIBIRSK_LATITUDE, NOVOSIBIRSK_LONGITUDE)
+
+async def check_external_temperature_alert(threshold=SPIKE_THRESHOLD, margin=EXTERNAL_MARGIN,
+                                           device_id=schema.DEFAULT_DEVICE):
+    values = LATEST.values('q', 5, device_id)
+    if len(values) < 2:
         return False, None, None, None, None
-    external_current = rows[0][0]
-    previous_values = [row[0] for row in rows[1:]]
+    external_current = values[0]
+    previous_values = values[1:]
     avg_previous = sum(previous_values) / len(previous_values)
     diff_external = external_current - avg_previous
     abs_diff = abs(diff_external)
-    external_temp_api = get_weather_novosibirsk()
+    external_temp_api = await get_weather_novosibirsk()
+    if external_temp_api is None:
+        # Внешняя температура неизвестна — подтвердить перепад нечем
+        return False, abs_diff, None, external_current, None
     if diff_external > threshold and (external_current - external_temp_api) > margin:
         return True, abs_diff, "increase", external_current, external_temp_api
     if diff_external < -threshold and (external_temp_api - external_current) > margin:
         return True, abs_diff, "decrease", external_current, external_temp_api
     return False, abs_diff, None, external_current, external_temp_api
 
-def check_internal_temperature_spike(threshold=10.0):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT value FROM sensor_data WHERE sensor='tempC' ORDER BY timestamp DESC LIMIT 5")
-    rows = c.fetchall()
-    conn.close()
-    if len(rows) < 2:
+def check_internal_temperature_spike(threshold=INTERNAL_SPIKE_THRESHOLD, device_id=schema.DEFAULT_DEVICE):
+    values = LATEST.values('tempC', 5, device_id)
+    if len(values) < 2:
         return False, None
-    current = rows[0][0]
-    previous_values = [row[0] for row in rows[1:]]
+    current = values[0]
+    previous_values = values[1:]
     avg_previous = sum(previous_values) / len(previous_values)
     diff = current - avg_previous
     if abs(diff) > threshold:
         return True, diff
     return False, diff
 
-def check_spike_alert():
-    spike_external, diff_external, direction, external_current, external_temp_api = check_external_temperature_alert()
-    spike_internal, diff_internal = check_internal_temperature_spike()
+async def check_spike_alert(device_id=schema.DEFAULT_DEVICE):
+    spike_external, diff_external, direction, external_current, external_temp_api = \
+        await check_external_temperature_alert(device_id=device_id)
+    spike_internal, diff_internal = check_internal_temperature_spike(device_id=device_id)
     messages = []
     if spike_external:
         if direction == "increase":
@@ -234,23 +404,46 @@ def check_spike_alert():
         return True, "; ".join(messages)
     return False, "Резкий перепад не обнаружен или данных недостаточно."
 
-def get_all_users():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT chat_id FROM users")
-    rows = c.fetchall()
-    conn.close()
-    return [row[0] for row in rows]
+async def get_all_users():
+    return await DB.users()
 
 def build_main_menu():
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     keyboard = [
         [InlineKeyboardButton("Текущие показания", callback_data="get_current")],
         [InlineKeyboardButton("Данные за период", callback_data="get_period_menu")],
-        [InlineKeyboardButton("Проверить перепад", callback_data="check_spike")]
+        [InlineKeyboardButton("Проверить перепад", callback_data="check_spike")],
+        [InlineKeyboardButton("Выбрать устройство", callback_data="get_device_menu")]
     ]
     return InlineKeyboardMarkup(keyboard)
 
+def device_menu_pages(devices, page_size=DEVICE_MENU_PAGE_SIZE):
+    return max((len(devices) + page_size - 1) // page_size, 1)
+
+def build_device_menu(devices, page=0, page_size=DEVICE_MENU_PAGE_SIZE):
+    """
+    Страница page меню выбора устройства. Устройства упорядочены по имени, чтобы
+    страницы не перемешивались между нажатиями, когда устройства присылают показания.
+    """
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    devices = sorted(devices)
+    pages = device_menu_pages(devices, page_size)
+    page = min(max(page, 0), pages - 1)
+    keyboard = [
+        [InlineKeyboardButton(device_id, callback_data=f"device:{device_id}")]
+        for device_id in devices[page * page_size:(page + 1) * page_size]
+    ]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀ Назад", callback_data=f"device_page:{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("Вперёд ▶", callback_data=f"device_page:{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(keyboard)
+
 def build_period_menu():
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     periods = [
         ("15 минут", 15),
         ("1 час", 60),
@@ -283,11 +476,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if ADMIN_CHAT_ID is None:
         ADMIN_CHAT_ID = update.effective_chat.id
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("INSERT OR IGNORE INTO users (chat_id) VALUES (?)", (update.effective_chat.id,))
-        conn.commit()
-        conn.close()
+        await DB.add_user(update.effective_chat.id)
     except Exception as e:
         print("Ошибка сохранения пользователя:", e)
     await update.message.reply_text("Добро пожаловать!", reply_markup=build_main_menu())
@@ -297,11 +486,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         data = query.data
+        device_id = await get_chat_device(context)
         if data == "get_current":
-            temp_data = get_current_data('tempC')
-            humidity_data = get_current_data('Humidity')
-            q_data = get_current_data('q')
-            text = "Текущие показания:\n"
+            temp_data, humidity_data, q_data = await asyncio.gather(
+                get_current_data('tempC', device_id),
+                get_current_data('Humidity', device_id),
+                get_current_data('q', device_id)
+            )
+            text = f"Текущие показания ({device_id}):\n"
             if temp_data:
                 text += f"Внутренняя температура (tempC): {temp_data[0]:.2f} °C\n"
             if humidity_data:
@@ -310,35 +502,45 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 text += f"Внешняя температура (q): {q_data[0]:.2f} °C\n"
             await query.edit_message_text(text=text)
             await send_main_menu(update.effective_chat.id, context)
+        elif data == "get_device_menu" or data.startswith("device_page:"):
+            page = int(data.split(":")[1]) if data.startswith("device_page:") else 0
+            devices = await get_devices()
+            if devices:
+                pages = device_menu_pages(devices)
+                page = min(max(page, 0), pages - 1)
+                text = "Выберите устройство:" if pages == 1 else f"Выберите устройство (страница {page + 1} из {pages}):"
+                await query.edit_message_text(text=text, reply_markup=build_device_menu(devices, page))
+            else:
+                await query.edit_message_text(text="Нет ни одного устройства с данными.")
+                await send_main_menu(update.effective_chat.id, context)
+        elif data.startswith("device:"):
+            context.chat_data["device_id"] = data.split(":", 1)[1]
+            await query.edit_message_text(text=f"Выбрано устройство: {context.chat_data['device_id']}")
+            await send_main_menu(update.effective_chat.id, context)
         elif data == "get_period_menu":
             await query.edit_message_text(text="Выберите период:", reply_markup=build_period_menu())
         elif data.startswith("period:"):
             minutes = int(data.split(":")[1])
-            end_time = datetime.datetime.now()
-            start_time = end_time - datetime.timedelta(minutes=minutes)
-            sensors = ['tempC', 'Humidity', 'q']
+            chart = await get_period_chart(SENSORS, minutes, device_id)
             messages = []
-            for sensor in sensors:
-                sensor_name = sensor
-                data_records = get_data_period(sensor, start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                                               end_time.strftime("%Y-%m-%d %H:%M:%S"))
-                if data_records:
-                    graph_file = generate_graph(data_records, sensor)
+            for sensor_name in SENSORS:
+                if chart is not None and sensor_name in chart.sensors:
                     messages.append(f"Данные за выбранный период для датчика: {sensor_name}")
-                    if graph_file and os.path.exists(graph_file):
-                        await context.bot.send_photo(
-                            chat_id=update.effective_chat.id,
-                            photo=open(graph_file, 'rb')
-                        )
-                    else:
-                        print(f"Не удалось найти файл графика для {sensor_name}")
                 else:
                     messages.append(f"Нет данных для датчика {sensor_name} за выбранный период.")
+            if chart is not None:
+                with metrics.timed(metrics.TELEGRAM_SECONDS, errors=metrics.TELEGRAM_ERRORS, method="send_photo"):
+                    message = await context.bot.send_photo(
+                        chat_id=update.effective_chat.id,
+                        photo=chart.file_id or chart.png
+                    )
+                if chart.file_id is None and message is not None and message.photo:
+                    chart.file_id = message.photo[-1].file_id
             await query.edit_message_text(text="\n".join(messages))
             await send_main_menu(update.effective_chat.id, context)
         elif data == "check_spike":
-            spike, message = check_spike_alert()
-            print("Результат проверки перепада:", spike, message)
+            spike, message = await check_spike_alert(device_id)
+            print("Результат проверки перепада:", device_id, spike, message)
             if spike:
                 text = f"Обнаружен резкий перепад: {message}"
                 await query.edit_message_text(text=text)
@@ -352,20 +554,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     external_msg = "; ".join(external_parts)
                 else:
                     external_msg = "Резкий перепад внешней температуры"
-                alert_graph_temp = generate_alert_graph("tempC", 360, internal_msg)
-                if alert_graph_temp and os.path.exists(alert_graph_temp):
-                    print("Отправляю график с аномалией для tempC")
-                    await context.bot.send_photo(chat_id=update.effective_chat.id,
-                                                 photo=open(alert_graph_temp, 'rb'))
+                alert_graph = await generate_alert_graph({"tempC": internal_msg, "q": external_msg}, 360, device_id)
+                if alert_graph:
+                    print("Отправляю общий график с аномалией для tempC и q")
+                    with metrics.timed(metrics.TELEGRAM_SECONDS, errors=metrics.TELEGRAM_ERRORS, method="send_photo"):
+                        await context.bot.send_photo(chat_id=update.effective_chat.id,
+                                                     photo=alert_graph)
                 else:
-                    print("График для tempC не создан или нет данных")
-                alert_graph_q = generate_alert_graph("q", 360, external_msg)
-                if alert_graph_q and os.path.exists(alert_graph_q):
-                    print("Отправляю график с аномалией для q")
-                    await context.bot.send_photo(chat_id=update.effective_chat.id,
-                                                 photo=open(alert_graph_q, 'rb'))
-                else:
-                    print("График для q не создан или нет данных")
+                    print("График с аномалией не создан или нет данных")
             else:
                 text = "Резкий перепад не обнаружен или данных недостаточно."
                 await query.edit_message_text(text=text)
@@ -378,29 +574,125 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=update.effective_chat.id,
                                        text="Произошла ошибка при обработке вашего запроса.")
 
-async def sensor_alert_job(context: ContextTypes.DEFAULT_TYPE):
-    spike, message = check_spike_alert()
-    if spike:
-        users = get_all_users()
-        for user in users:
-            await context.bot.send_message(chat_id=user, text=f"Автоматический алерт! {message}")
-            alert_graph_temp = generate_alert_graph("tempC", 360, message)
-            if alert_graph_temp and os.path.exists(alert_graph_temp):
-                await context.bot.send_photo(chat_id=user, photo=open(alert_graph_temp, 'rb'))
-            alert_graph_q = generate_alert_graph("q", 360, message)
-            if alert_graph_q and os.path.exists(alert_graph_q):
-                await context.bot.send_photo(chat_id=user, photo=open(alert_graph_q, 'rb'))
+async def weather_refresh_job(context: ContextTypes.DEFAULT_TYPE):
+    await WEATHER.refresh_all()
+
+def start_metrics(mqtt_handler):
+    """Включает сбор метрик, регистрирует состояние очередей и кэшей и запускает /metrics."""
+    metrics.enable()
+    metrics.REGISTRY.gauge("smarttemp_ingest", "Состояние очереди записи показаний", mqtt_handler.writer.stats)
+    metrics.REGISTRY.gauge("smarttemp_batches", "Пачки показаний: принятые, повторы, пропуски и перезапуски устройств",
+                           mqtt_handler.sequences.stats)
+    metrics.REGISTRY.gauge("smarttemp_chart_cache", "Кэш графиков", lambda: CHARTS.stats())
+    metrics.REGISTRY.gauge("smarttemp_weather_cache", "Кэш внешней температуры", WEATHER.stats)
+    metrics.REGISTRY.gauge("smarttemp_updates", "Обработка обновлений Telegram",
+                           lambda: UPDATES.stats() if UPDATES is not None else {})
+    try:
+        METRICS_SERVER.start()
+        print(f"Метрики доступны на http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print("Не удалось запустить сервер метрик:", e)
+
+async def close_weather(application):
+    await WEATHER.aclose()
+
+async def describe_alert(event, margin=EXTERNAL_MARGIN):
+    direction = "рост" if event.diff > 0 else "падение"
+    device = f"[{event.device_id}] "
+    if event.sensor == 'q':
+        external_temp_api = await get_weather_novosibirsk()
+        if external_temp_api is None:
+            return None
+        if event.diff > 0 and (event.value - external_temp_api) <= margin:
+            return None
+        if event.diff < 0 and (external_temp_api - event.value) <= margin:
+            return None
+        return (f"{device}внешней температуры ({direction}: изменение {abs(event.diff):.2f}°C, "
+                f"тек. {event.value:.2f}°C, API: {external_temp_api:.2f}°C)")
+    return f"{device}внутренней температуры ({direction}: изменение {event.diff:.2f}°C)"
+
+async def send_alert(bot, message, sensors, device_id=schema.DEFAULT_DEVICE):
+    users = await get_all_users()
+    if not users:
+        return
+    # Графики строятся один раз на алерт и рассылаются всем подписчикам
+    photos = [await generate_alert_graph({sensor: message for sensor in sensors}, 360, device_id)]
+    delivered, failed = await delivery.broadcast_alert(
+        bot, users, f"Автоматический алерт! {message}", photos,
+        DELIVERY_LIMITER, concurrency=ALERT_SEND_CONCURRENCY
+    )
+    print(f"Алерт доставлен {delivered} пользователям, ошибок: {failed}")
+
+async def alert_consumer(application):
+    while True:
+        event = await DETECTOR.queue.get()
+        try:
+            # Пока отправлялся предыдущий алерт, по датчику мог начаться период подавления
+            if not DETECTOR.ready(event):
+                continue
+            message = await describe_alert(event)
+            if message:
+                await send_alert(application.bot, message, [event.sensor], event.device_id)
+                DETECTOR.confirm(event)
+        except Exception as e:
+            print("Ошибка обработки алерта:", e)
+
+async def post_init(application):
+    DETECTOR.attach(asyncio.get_running_loop())
+    application.create_task(alert_consumer(application))
+
+def create_update_processor():
+    global UPDATES
+    if UPDATES is None:
+        from updates import PerChatUpdateProcessor
+        UPDATES = PerChatUpdateProcessor(max_concurrent=UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING)
+    return UPDATES
 
 def main():
     check_and_create_db()
+    LATEST.warm(STORE, SENSORS)
+    for device_id, sensor in LATEST.keys():
+        DETECTOR.warm(sensor, reversed(LATEST.values(sensor, LATEST_WINDOW_SIZE, device_id)), device_id)
+    # Приём показаний запускается первым: бот и построение графиков догружаются после
     mqtt_handler = MQTTClientHandler()
+    if METRICS_ENABLED:
+        start_metrics(mqtt_handler)
     Thread(target=mqtt_handler.start, daemon=True).start()
-    app = ApplicationBuilder().token(TOKEN).build()
+    RENDERER.start()
+    RENDERER.warm_up()
+    if STORE_BACKEND == "sqlite":
+        RETENTION.start()
+    from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(create_update_processor())
+        .post_init(post_init)
+        .post_shutdown(close_weather)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(button_handler))
-    app.job_queue.run_repeating(sensor_alert_job, interval=300, first=10)
-    print("Бот запущен, начинаем опрос обновлений...")
-    app.run_polling()
+    app.job_queue.run_repeating(weather_refresh_job, interval=WEATHER_TTL, first=WEATHER_TTL)
+    if BOT_MODE == "webhook":
+        print(f"Бот запущен, принимаем обновления на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET
+        )
+    else:
+        print("Бот запущен, начинаем опрос обновлений...")
+        app.run_polling()
+    # Сначала приём MQTT и запись очереди, иначе хранилище закроется посреди сброса пачки
+    mqtt_handler.stop()
+    RETENTION.stop()
+    METRICS_SERVER.stop()
+    RENDERER.shutdown()
+    DB.shutdown()
+    STORE.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,389 @@
+"""
+Массовая загрузка исторических показаний и их воспроизведение.
+
+  python backfill.py generate --devices 10 --days 90 --output data.csv
+  python backfill.py load data.csv
+  python backfill.py load dump.txt --format mqtt
+  python backfill.py replay dump.txt --speed 60
+
+Форматы входа:
+  csv  — с заголовком. Длинный вид: колонки sensor, value и ts (секунды Unix) или
+         timestamp ("%Y-%m-%d %H:%M:%S", локальное время), необязательная device_id.
+         Широкий вид: ts или timestamp, необязательная device_id, остальные колонки —
+         датчики (tempC, Humidity, q). Пустые ячейки пропускаются.
+  mqtt — запись брокера: mosquitto_sub -v -t 'sensors/#' -F '%U %t %x' > dump.txt,
+         в строке время получения, топик и payload в hex. Пакеты ESP (топик batch)
+         разбираются и очищаются от повторов так же, как в боте.
+
+load пишет пачками по --chunk строк, каждая пачка — одна транзакция. Индексы
+sensor_data на время загрузки снимаются (кроме --keep-indexes), агрегаты и таблица
+устройств обновляются одним проходом в конце. Если бот в это время работает с той
+же БД, лучше указать --keep-indexes: без индексов его выборки медленнее.
+
+replay отправляет записанные сообщения через MQTTClientHandler (очередь записи,
+окна последних значений, детектор перепадов) со скоростью --speed относительно
+реального времени; --speed 0 — без пауз.
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import itertools
+import math
+import sys
+import time
+
+import numpy as np
+
+import app
+import payload
+import rollups
+import schema
+import storage
+from file_store import ColumnarFileStore
+from ingest import IngestWriter
+from schema import DEFAULT_DEVICE, format_timestamp
+from sensor_store import SqliteSensorStore
+from topics import TopicRouter, BATCH
+
+# Строк в одной транзакции при загрузке
+CHUNK_ROWS = 50000
+# Страничный кэш соединения загрузки, КиБ
+LOAD_CACHE_SIZE_KIB = 262144
+
+
+class DumpMessage:
+    """Сообщение из записи в том виде, в каком paho передаёт его в on_message."""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def read_csv(f, default_device=DEFAULT_DEVICE):
+    """Показания (device_id, sensor, value, ts) из CSV в длинном или широком виде."""
+    reader = csv.reader(f)
+    header = [name.strip() for name in next(reader)]
+    columns = {name: i for i, name in enumerate(header)}
+    if "ts" in columns:
+        ts_column, parse_ts = columns["ts"], lambda text: int(float(text))
+    elif "timestamp" in columns:
+        ts_column, parse_ts = columns["timestamp"], schema.to_epoch
+    else:
+        raise ValueError("В CSV нет колонки ts или timestamp")
+    device_column = columns.get("device_id")
+    if "sensor" in columns and "value" in columns:
+        sensor_column, value_column = columns["sensor"], columns["value"]
+        for record in reader:
+            if not record or not record[value_column]:
+                continue
+            device_id = record[device_column] if device_column is not None else default_device
+            yield device_id, record[sensor_column], float(record[value_column]), parse_ts(record[ts_column])
+        return
+    sensors = [(i, name) for i, name in enumerate(header) if name not in ("ts", "timestamp", "device_id")]
+    for record in reader:
+        if not record:
+            continue
+        device_id = record[device_column] if device_column is not None else default_device
+        ts = parse_ts(record[ts_column])
+        for i, sensor in sensors:
+            if record[i]:
+                yield device_id, sensor, float(record[i]), ts
+
+
+def read_dump(f):
+    """Сообщения (ts, topic, payload) из записи mosquitto_sub -F '%U %t %x'."""
+    for number, line in enumerate(f, 1):
+        parts = line.split()
+        if not parts:
+            continue
+        try:
+            ts, topic, data = parts if len(parts) == 3 else (*parts, "")
+            yield float(ts), topic, bytes.fromhex(data)
+        except ValueError:
+            print(f"Строка {number} записи пропущена: {line.strip()[:80]}")
+
+
+def dump_readings(messages, router, sequences):
+    """Показания (device_id, sensor, value, ts) из сообщений записи, как их разобрал бы MQTTClientHandler."""
+    for ts, topic, data in messages:
+        route = router.resolve(topic)
+        if route is None:
+            continue
+        device_id, sensor = route
+        ts = int(ts)
+        if sensor == BATCH:
+            try:
+                batch = payload.decode_batch(data)
+            except ValueError:
+                continue
+            if sequences.check(device_id, batch.seq, batch.uptime):
+                for batch_sensor, value in batch.readings:
+                    yield device_id, batch_sensor, value, ts
+            continue
+        try:
+            value = float(data.decode())
+        except ValueError:
+            continue
+        if not math.isnan(value):
+            yield device_id, sensor, value, ts
+
+
+def csv_messages(rows):
+    """Показания из CSV в виде текстовых сообщений sensors/<device_id>/<metric> для replay."""
+    metrics = {sensor: metric for metric, sensor in app.METRICS.items()}
+    for device_id, sensor, value, ts in rows:
+        metric = metrics.get(sensor)
+        if metric is not None:
+            yield ts, f"sensors/{device_id}/{metric}", repr(value).encode()
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_sqlite(db_file, rows, chunk_size=CHUNK_ROWS, defer_indexes=True):
+    """
+    Загружает показания в SQLite: одна транзакция на пачку, индексы снимаются на время
+    загрузки и строятся заново в конце, агрегаты и устройства обновляются по диапазонам
+    id вставленных строк. Возвращает число строк.
+    """
+    schema.check_and_create_db(db_file)
+    conn = storage.connect(db_file, cache_size_kib=LOAD_CACHE_SIZE_KIB)
+    # Диапазоны id вставленных строк; AUTOINCREMENT внутри транзакции выдаёт id подряд
+    ranges = []
+    loaded = 0
+    start = time.perf_counter()
+    try:
+        if defer_indexes:
+            with conn:
+                for name, _ in schema.SENSOR_DATA_INDEXES:
+                    conn.execute(f"DROP INDEX IF EXISTS {name}")
+        for chunk in chunked(rows, chunk_size):
+            stamps = {}
+            with conn:
+                conn.executemany(
+                    "INSERT INTO sensor_data (device_id, sensor, value, timestamp, ts) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (device_id, sensor, value,
+                         stamps.get(ts) or stamps.setdefault(ts, format_timestamp(ts)), ts)
+                        for device_id, sensor, value, ts in chunk
+                    ]
+                )
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            first_id = last_id - len(chunk) + 1
+            if ranges and ranges[-1][1] + 1 == first_id:
+                ranges[-1] = (ranges[-1][0], last_id)
+            else:
+                ranges.append((first_id, last_id))
+            loaded += len(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"Загружено {loaded} строк, {loaded / elapsed:.0f} строк/с")
+    finally:
+        if defer_indexes:
+            print("Построение индексов...")
+            with conn:
+                for name, columns in schema.SENSOR_DATA_INDEXES:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON sensor_data {columns}")
+        print("Обновление агрегатов и устройств...")
+        with conn:
+            for first_id, last_id in ranges:
+                rollups.merge_raw_rows(conn, first_id, last_id)
+                seen = conn.execute(
+                    "SELECT device_id, MIN(ts), MAX(ts) FROM sensor_data "
+                    "WHERE id BETWEEN ? AND ? AND ts IS NOT NULL GROUP BY device_id",
+                    (first_id, last_id)
+                ).fetchall()
+                schema.touch_devices(conn, [(device_id, ts) for device_id, *bounds in seen for ts in bounds])
+        conn.close()
+    return loaded
+
+
+def load_store(store, rows, chunk_size=CHUNK_ROWS):
+    """Загрузка через SensorStore.append (для хранилищ без SQL). Возвращает число строк."""
+    store.prepare()
+    loaded = 0
+    start = time.perf_counter()
+    for chunk in chunked(rows, chunk_size):
+        store.append(chunk)
+        loaded += len(chunk)
+        print(f"Загружено {loaded} строк, {loaded / (time.perf_counter() - start):.0f} строк/с")
+    return loaded
+
+
+def generate(f, devices, days, step, end_ts=None, seed=0):
+    """Пишет в f синтетические показания в длинном CSV: случайное блуждание по каждому ряду."""
+    end_ts = end_ts or int(time.time()) // step * step
+    start_ts = end_ts - days * 86400
+    rng = np.random.default_rng(seed)
+    bases = {"tempC": 22.0, "Humidity": 40.0, "q": -5.0}
+    writer = csv.writer(f)
+    writer.writerow(["device_id", "sensor", "value", "ts"])
+    last = {(f"dev-{d}", sensor): base for d in range(devices) for sensor, base in bases.items()}
+    written = 0
+    # По суткам, чтобы не держать в памяти весь набор
+    for day_start in range(start_ts, end_ts, 86400):
+        ts = np.arange(day_start, min(day_start + 86400, end_ts), step)
+        columns = {}
+        for key, value in last.items():
+            series = value + rng.normal(0.0, 0.05, len(ts)).cumsum()
+            columns[key] = series
+            last[key] = float(series[-1])
+        for i, t in enumerate(ts.tolist()):
+            writer.writerows((device_id, sensor, f"{series[i]:.3f}", t)
+                             for (device_id, sensor), series in columns.items())
+        written += len(ts) * len(columns)
+    return written
+
+
+async def replay(handler, messages, speed, live_time=False):
+    """
+    Отправляет сообщения (ts, topic, payload) в handler.on_message, выдерживая паузы
+    записи, ускоренные в speed раз. Метки времени показаний — записанные (или текущие
+    при live_time). Возвращает (число сообщений, список алертов детектора).
+    """
+    loop = asyncio.get_running_loop()
+    handler.detector.attach(loop)
+    alerts = []
+
+    async def consume():
+        # Как alert_consumer бота: повторы в пределах cooldown после алерта не считаются
+        while True:
+            event = await handler.detector.queue.get()
+            if handler.detector.ready(event):
+                handler.detector.confirm(event)
+                alerts.append(event)
+
+    consumer = asyncio.create_task(consume())
+    current = [None]
+    if not live_time:
+        handler.clock = lambda: current[0]
+    sent = 0
+    start = loop.time()
+    first_ts = None
+    for ts, topic, data in messages:
+        if first_ts is None:
+            first_ts = ts
+        if speed:
+            delay = start + (ts - first_ts) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        current[0] = ts
+        handler.on_message(None, None, DumpMessage(topic, data))
+        sent += 1
+        if sent % 1000 == 0:
+            # Даём циклу разобрать алерты, если пауз между сообщениями нет
+            await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    consumer.cancel()
+    return sent, alerts
+
+
+def open_input(path):
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin)
+    return open(path, newline="")
+
+
+def input_format(args):
+    if args.format != "auto":
+        return args.format
+    return "csv" if args.input.endswith(".csv") or args.input == "-" else "mqtt"
+
+
+def cmd_generate(args):
+    with contextlib.ExitStack() as stack:
+        f = sys.stdout if args.output == "-" else stack.enter_context(open(args.output, "w", newline=""))
+        written = generate(f, args.devices, args.days, args.step, seed=args.seed)
+    print(f"Сгенерировано {written} показаний", file=sys.stderr)
+
+
+def cmd_load(args):
+    start = time.perf_counter()
+    with open_input(args.input) as f:
+        if input_format(args) == "csv":
+            rows = read_csv(f, args.device)
+        else:
+            router = TopicRouter(app.METRICS, app.TOPICS, DEFAULT_DEVICE)
+            rows = dump_readings(read_dump(f), router, payload.SequenceTracker())
+        if args.backend == "sqlite":
+            loaded = load_sqlite(args.db, rows, args.chunk, defer_indexes=not args.keep_indexes)
+        else:
+            loaded = load_store(ColumnarFileStore(args.store_dir), rows, args.chunk)
+    elapsed = time.perf_counter() - start
+    print(f"Загружено {loaded} показаний за {elapsed:.1f} с ({loaded / elapsed * 60:.0f} строк/мин)")
+
+
+def cmd_replay(args):
+    if args.backend == "sqlite":
+        store = SqliteSensorStore(args.db)
+    else:
+        store = ColumnarFileStore(args.store_dir)
+    store.prepare()
+    writer = IngestWriter(store, batch_size=app.INGEST_BATCH_SIZE, flush_interval_ms=app.INGEST_FLUSH_INTERVAL_MS,
+                          max_queue=app.INGEST_MAX_QUEUE, overflow="block", versions=app.DATA_VERSIONS)
+    handler = app.MQTTClientHandler(writer=writer)
+    start = time.perf_counter()
+    writer.start()
+    with open_input(args.input) as f:
+        if input_format(args) == "csv":
+            messages = csv_messages(read_csv(f, args.device))
+        else:
+            messages = read_dump(f)
+        output = io.StringIO() if args.quiet else sys.stdout
+        with contextlib.redirect_stdout(output):
+            sent, alerts = asyncio.run(replay(handler, messages, args.speed, args.live_time))
+    writer.stop()
+    store.close()
+    elapsed = time.perf_counter() - start
+    stats = writer.stats()
+    print(f"Воспроизведено {sent} сообщений за {elapsed:.1f} с, записано показаний: {stats['written']}, "
+          f"отброшено: {stats['dropped']}")
+    print(f"Алертов детектора: {len(alerts)}")
+    for event in alerts[:20]:
+        print(f"  {format_timestamp(event.ts)} [{event.device_id}] {event.sensor}: "
+              f"{event.value:.2f} (изменение {event.diff:+.2f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="синтетический набор данных в CSV")
+    gen.add_argument("--devices", type=int, default=3)
+    gen.add_argument("--days", type=int, default=30)
+    gen.add_argument("--step", type=int, default=60, help="интервал показаний, с")
+    gen.add_argument("--seed", type=int, default=0)
+    gen.add_argument("--output", default="-")
+    gen.set_defaults(func=cmd_generate)
+
+    for name, func, help in (("load", cmd_load, "массовая загрузка в хранилище"),
+                             ("replay", cmd_replay, "воспроизведение через приём MQTT и детектор")):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("input", help="файл CSV или записи MQTT, - для stdin")
+        command.add_argument("--format", choices=["auto", "csv", "mqtt"], default="auto")
+        command.add_argument("--device", default=DEFAULT_DEVICE, help="устройство для CSV без колонки device_id")
+        command.add_argument("--backend", choices=["sqlite", "columnar"], default=app.STORE_BACKEND)
+        command.add_argument("--db", default=app.DB_FILE)
+        command.add_argument("--store-dir", default=app.COLUMNAR_STORE_DIR)
+        command.set_defaults(func=func)
+        if name == "load":
+            command.add_argument("--chunk", type=int, default=CHUNK_ROWS)
+            command.add_argument("--keep-indexes", action="store_true", help="не снимать индексы на время загрузки")
+        else:
+            command.add_argument("--speed", type=float, default=1.0, help="ускорение относительно записи, 0 — без пауз")
+            command.add_argument("--live-time", action="store_true", help="ставить показаниям текущее время")
+            command.add_argument("--quiet", action="store_true", help="не печатать каждое сообщение")
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
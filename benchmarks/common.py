@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import schema
+
+
+def temp_db(prefix="smarttemp-bench-"):
+    """Создаёт пустую БД с актуальной схемой во временном каталоге и возвращает путь к ней."""
+    directory = tempfile.mkdtemp(prefix=prefix)
+    db_file = os.path.join(directory, "sensor_data.db")
+    schema.check_and_create_db(db_file)
+    return db_file
+
+
+def remove_db(db_file):
+    shutil.rmtree(os.path.dirname(db_file), ignore_errors=True)
+
+
+def fill_sensor(db_file, sensor, n_rows, start_ts=1735689600, step=60, seed=0):
+    """Записывает n_rows синтетических показаний с шагом step секунд (без агрегатов)."""
+    rng = np.random.default_rng(seed)
+    values = 20.0 + rng.normal(0.0, 1.0, n_rows).cumsum() * 0.05
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.executemany(
+            "INSERT INTO sensor_data (sensor, value, timestamp, ts) VALUES (?, ?, ?, ?)",
+            ((sensor, float(v), schema.format_timestamp(start_ts + i * step), start_ts + i * step)
+             for i, v in enumerate(values))
+        )
+    conn.close()
+    return start_ts, start_ts + (n_rows - 1) * step
+
+
+def percentile_ms(samples, q):
+    """Перцентиль q выборки длительностей в секундах, в миллисекундах."""
+    if not samples:
+        return 0.0
+    return float(np.percentile(samples, q)) * 1000.0
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_result(result, path):
+    """Сохраняет отчёт {"params", "environment", "results"} в JSON для сравнения с --compare."""
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nРезультат сохранён в {path}")
+
+
+def flatten(result, prefix=""):
+    """Числовые метрики отчёта в виде {"ingest.rows_per_s": ...} для сравнения."""
+    flat = {}
+    for key, value in result.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current, path):
+    """Печатает изменение числовых метрик отчёта current относительно сохранённого в path."""
+    with open(path) as f:
+        previous = json.load(f)
+    changed = [key for key, value in current["params"].items()
+               if key not in ("output", "compare") and previous.get("params", {}).get(key) != value]
+    if changed:
+        print(f"\nВнимание: параметры прогонов различаются: {', '.join(changed)}")
+    old = flatten(previous.get("results", {}))
+    print(f"\n{'метрика':<40} {'было':>12} {'стало':>12} {'изменение':>10}")
+    for name, value in flatten(current["results"]).items():
+        if name not in old:
+            continue
+        before = old[name]
+        change = f"{(value - before) / before * 100:+.1f}%" if before else "—"
+        print(f"{name:<40} {before:>12.2f} {value:>12.2f} {change:>10}")
+
+
+class FakeMqttMessage:
+    """Сообщение в том виде, в каком paho передаёт его в on_message."""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class BrokerStub:
+    """
+    Брокер MQTT внутри процесса: publish сразу вызывает on_message подписчика,
+    как это делает сетевой цикл paho, но без сети.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.published = 0
+
+    def publish(self, topic, payload):
+        self.published += 1
+        self.handler.on_message(None, None, FakeMqttMessage(topic, payload))
+
+
+class FakePhotoSize:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class FakeMessage:
+    def __init__(self, message_id, photo=None):
+        self.message_id = message_id
+        self.photo = photo or []
+
+
+class FakeBot:
+    """
+    Заглушка telegram.Bot для методов, которые вызывает бот: отвечает после задержки
+    latency секунд (имитация сети) и считает вызовы по методам.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        # Сколько раз фото загружалось байтами, а не по file_id
+        self.uploads = 0
+        self._next_id = 0
+
+    async def _reply(self, method, photo=None):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self._next_id += 1
+        return FakeMessage(self._next_id, photo)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._reply("send_message")
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        if isinstance(photo, str):
+            file_id = photo
+        else:
+            self.uploads += 1
+            file_id = f"file-{self.uploads}"
+        return await self._reply("send_photo", [FakePhotoSize(file_id)])
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakeCallbackQuery:
+    def __init__(self, data, bot):
+        self.data = data
+        self.bot = bot
+
+    async def answer(self):
+        await self.bot._reply("answer_callback_query")
+
+    async def edit_message_text(self, text, **kwargs):
+        await self.bot._reply("edit_message_text")
+
+
+class FakeUpdate:
+    """Нажатие inline-кнопки: то, что button_handler читает из telegram.Update."""
+
+    def __init__(self, chat_id, data, bot):
+        self.effective_chat = FakeChat(chat_id)
+        self.callback_query = FakeCallbackQuery(data, bot)
+
+
+class FakeContext:
+    def __init__(self, bot, chat_data=None):
+        self.bot = bot
+        self.chat_data = chat_data if chat_data is not None else {}
@@ -0,0 +1,64 @@
+"""
+Сравнение разбора результатов запроса за период: построчный путь
+(fetchall + strptime, как раньше в generate_graph) против колоночного
+(columnar.fetch_array + datetime64).
+
+Запуск: python -m benchmarks.parse_period [--sizes 10000 100000 1000000]
+"""
+import argparse
+import datetime
+import sqlite3
+import time
+
+import columnar
+import schema
+from benchmarks.common import temp_db, remove_db, fill_sensor
+
+
+def rows_path(conn, sensor, start_ts, end_ts):
+    rows = conn.execute(
+        "SELECT value, timestamp FROM sensor_data WHERE sensor=? AND ts BETWEEN ? AND ? ORDER BY ts",
+        (sensor, start_ts, end_ts)
+    ).fetchall()
+    values = [row[0] for row in rows]
+    timestamps = [datetime.datetime.strptime(row[1], schema.TIMESTAMP_FORMAT) for row in rows]
+    return values, timestamps
+
+
+def columnar_path(conn, sensor, start_ts, end_ts):
+    series = columnar.fetch_array(conn.execute(
+        "SELECT ts, value FROM sensor_data WHERE sensor=? AND ts BETWEEN ? AND ? ORDER BY ts",
+        (sensor, start_ts, end_ts)
+    ))
+    return series['value'], columnar.local_datetimes(series['ts'])
+
+
+def best_of(func, repeat, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'строк':>10} {'строки, с':>12} {'numpy, с':>12} {'ускорение':>10}")
+    for n in args.sizes:
+        db_file = temp_db()
+        start_ts, end_ts = fill_sensor(db_file, "tempC", n)
+        conn = sqlite3.connect(db_file)
+        rows_time = best_of(rows_path, args.repeat, conn, "tempC", start_ts, end_ts)
+        numpy_time = best_of(columnar_path, args.repeat, conn, "tempC", start_ts, end_ts)
+        conn.close()
+        remove_db(db_file)
+        print(f"{n:>10} {rows_time:>12.4f} {numpy_time:>12.4f} {rows_time / numpy_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
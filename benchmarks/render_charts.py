@@ -0,0 +1,129 @@
+"""
+Время построения и пиковая память общего графика бота (render.render_panels по датчикам
+app.SENSORS) за окна от 15 минут до года: все точки с маркерами (как раньше) против
+прореживания до render.POINTS_PER_PIXEL точек на пиксель ширины (M4 для сырых рядов,
+слияние корзин для агрегатов).
+
+Ряды готовятся так же, как в app.get_period_series_many: сырые показания, пока
+rollups.choose_resolution не выбирает агрегаты, и корзины columnar.aggregate дальше.
+С --raw всегда рисуются сырые ряды — худший случай, на котором видна работа M4.
+
+Время — лучшее из --repeat построений; пиковая память — отдельное построение под
+tracemalloc (учитываются выделения Python и NumPy, буфер Agg одинаков в обоих режимах).
+Ряды синтетические: показание каждые --step секунд со случайными выбросами.
+
+Запуск: python -m benchmarks.render_charts [--windows 15 60 1440 10080 43200 525600]
+                                           [--step 10] [--raw] [--output render.json]
+                                           [--compare previous.json]
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+import app
+import columnar
+import render
+import rollups
+from benchmarks.common import compare, environment, save_result
+
+DEFAULT_WINDOWS = [15, 60, 1440, 10080, 43200, 525600]
+
+MODES = {
+    # Как было до прореживания: каждая точка с маркером
+    "all": (None, float("inf")),
+    "downsample": (render.POINTS_PER_PIXEL, render.MARKER_MAX_POINTS),
+}
+
+
+def make_series(minutes, step, seed=0, start_ts=1735689600):
+    n = max(minutes * 60 // step, 1)
+    rng = np.random.default_rng(seed)
+    series = np.empty(n, dtype=columnar.RAW_DTYPE)
+    series['ts'] = start_ts + np.arange(n, dtype='<i8') * step
+    series['value'] = 22.0 + np.cumsum(rng.normal(0.0, 0.02, n))
+    spikes = rng.integers(0, n, size=max(n // 100_000, 1))
+    series['value'][spikes] += 15.0
+    return series
+
+
+def make_panels(minutes, step, raw=False):
+    """Панели общего графика, как их собирает app.generate_panels для ряда каждого датчика."""
+    resolution = None if raw else rollups.choose_resolution(minutes * 60)
+    panels = []
+    for seed, sensor in enumerate(app.SENSORS):
+        series = make_series(minutes, step, seed)
+        if resolution is not None:
+            series = columnar.aggregate(series, resolution[1])
+        panels.append((sensor, series, app.SENSOR_COLORS.get(sensor, 'black'), None))
+    return panels
+
+
+def render_chart(panels):
+    return render.render_panels(panels, f'Показания {app.schema.DEFAULT_DEVICE} за период')
+
+
+def drawn_points(panels):
+    fig = render._new_figure(figsize=(10, 1 + 3 * len(panels)))
+    return sum(len(render._prepare(fig, series)) for _, series, _, _ in panels)
+
+
+def set_mode(mode):
+    render.POINTS_PER_PIXEL, render.MARKER_MAX_POINTS = MODES[mode]
+
+
+def measure(panels, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_chart(panels)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    render_chart(panels)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"render_ms": best * 1000.0, "peak_mb": peak / 2 ** 20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--windows", type=int, nargs="+", default=DEFAULT_WINDOWS, help="окна, минуты")
+    parser.add_argument("--step", type=int, default=10, help="интервал показаний, секунды")
+    parser.add_argument("--raw", action="store_true", help="рисовать сырые ряды и для длинных окон")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="куда сохранить результат в JSON")
+    parser.add_argument("--compare", default=None, help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    # Первый график загружает matplotlib и кэш шрифтов; в замер он не входит
+    render_chart(make_panels(15, args.step))
+    results = {}
+    print(f"{'окно, мин':>10} {'точек':>9} {'режим':>10} {'на графике':>11} {'время, мс':>10} {'память, МБ':>11}")
+    for minutes in args.windows:
+        panels = make_panels(minutes, args.step, args.raw)
+        points = sum(len(series) for _, series, _, _ in panels)
+        results[str(minutes)] = {}
+        for mode in MODES:
+            set_mode(mode)
+            result = measure(panels, args.repeat)
+            result["points"] = points
+            result["drawn"] = drawn_points(panels)
+            results[str(minutes)][mode] = result
+            print(f"{minutes:>10} {points:>9} {mode:>10} {result['drawn']:>11} "
+                  f"{result['render_ms']:>10.1f} {result['peak_mb']:>11.1f}")
+    set_mode("downsample")
+
+    result = {
+        "params": vars(args),
+        "environment": environment(),
+        "results": results,
+    }
+    if args.output:
+        save_result(result, args.output)
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Время запуска бота по данным python -X importtime в отдельных процессах.
+
+Замеряется импорт app (после него можно запускать приём MQTT) и полная готовность
+бота: импорт app плюс библиотеки telegram и обработчика обновлений, как в main().
+Для каждого этапа берётся медиана по --repeat запускам; выводятся самые тяжёлые
+модули и то, какие тяжёлые библиотеки загружаются уже при импорте app.
+
+Запуск: python -m benchmarks.startup [--repeat 5] [--output startup.json]
+                                     [--compare previous.json]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import compare, environment, save_result
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = {
+    "ingest_ready": "import app",
+    "bot_ready": "import app; import telegram.ext; app.create_update_processor()",
+}
+# Библиотеки, которые не должны загружаться до запуска приёма MQTT
+HEAVY_MODULES = ["telegram", "tornado", "httpx", "matplotlib", "requests"]
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run_stage(code):
+    """Один запуск: (время процесса, с; {модуль: (собственное, суммарное время, мкс)})."""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    elapsed = time.perf_counter() - start
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us))
+    return elapsed, modules
+
+
+def measure(code, repeat):
+    runs = [run_stage(code) for _ in range(repeat)]
+    wall = [elapsed for elapsed, _ in runs]
+    imports = [sum(self_us for self_us, _ in modules.values()) for _, modules in runs]
+    median_run = sorted(runs, key=lambda run: run[0])[len(runs) // 2]
+    return {
+        "wall_ms": statistics.median(wall) * 1000.0,
+        "imports_ms": statistics.median(imports) / 1000.0,
+        "app_import_ms": median_run[1].get("app", (0, 0))[1] / 1000.0,
+        "modules": len(median_run[1]),
+    }, median_run[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", default=None, help="куда сохранить результат в JSON")
+    parser.add_argument("--compare", default=None, help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    # Первый запуск собирает кэш байт-кода и шрифтов; в замер он не входит
+    run_stage(STAGES["bot_ready"])
+    results = {}
+    loaded = {}
+    for stage, code in STAGES.items():
+        results[stage], modules = measure(code, args.repeat)
+        loaded[stage] = modules
+        print(f"{stage}: процесс {results[stage]['wall_ms']:.0f} мс, импорты {results[stage]['imports_ms']:.0f} мс, "
+              f"import app {results[stage]['app_import_ms']:.0f} мс, модулей {results[stage]['modules']}")
+
+    heavy = [name for name in HEAVY_MODULES if name in loaded["ingest_ready"]]
+    print(f"\nТяжёлые библиотеки при импорте app: {', '.join(heavy) if heavy else 'нет'}")
+    print(f"\n{'модуль':<45} {'собств., мс':>12} {'всего, мс':>10}")
+    top = sorted(loaded["ingest_ready"].items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    for name, (self_us, cumulative_us) in top:
+        print(f"{name:<45} {self_us / 1000:>12.1f} {cumulative_us / 1000:>10.1f}")
+
+    result = {
+        "params": vars(args),
+        "environment": environment(),
+        "results": results,
+        "heavy_at_import": heavy,
+    }
+    if args.output:
+        save_result(result, args.output)
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Нагрузочный прогон всего пути данных без сети: синтетические потоки показаний
+с нескольких устройств публикуются через брокер-заглушку в MQTTClientHandler,
+запросы графиков идут через button_handler с поддельным ботом Telegram,
+алерт рассылается через delivery.broadcast_alert.
+
+Отчёт: скорость приёма (строк/с), p50/p99 времени сброса пачки в хранилище,
+время обработки сообщения MQTT, время графика по периодам (холодный и из кэша)
+и время рассылки алерта. Результат сохраняется в JSON; с --compare выводится
+разница с предыдущим прогоном.
+
+Очередь записи по умолчанию работает с политикой block: публикация ждёт, пока
+хранилище освободит место, поэтому строк/с — устойчивая скорость записи. Если
+показания всё же отброшены (например, с --overflow drop_oldest), скрипт
+завершается с ненулевым кодом.
+
+Запуск: python -m benchmarks.throughput [--devices 10 --rate 500 --duration 10]
+                                        [--backend sqlite|columnar] [--output result.json]
+                                        [--compare previous.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import app
+import payload
+from benchmarks.common import (
+    BrokerStub, FakeBot, FakeContext, FakeUpdate, compare, environment, percentile_ms, remove_db,
+    save_result, temp_db
+)
+from chart_cache import ChartCache
+from delivery import RateLimiter, broadcast_alert
+from file_store import ColumnarFileStore
+from ingest import IngestWriter
+from sensor_store import AsyncSensorStore, SqliteSensorStore
+from topics import BATCH
+
+# С политикой "block" производитель ждёт места в очереди, а не теряет показания
+BLOCK_PUT_TIMEOUT = 60.0
+DEFAULT_PERIODS = [15, 60, 360, 1440, 14400, 43200]
+# Устройство, на котором проверяются графики; история заполняется только для него
+CHART_DEVICE = "bench-0"
+
+
+def open_store(backend):
+    """Временное хранилище выбранного типа и функция его удаления."""
+    if backend == "sqlite":
+        db_file = temp_db()
+        return SqliteSensorStore(db_file), lambda: remove_db(db_file)
+    directory = tempfile.mkdtemp(prefix="smarttemp-bench-")
+    store = ColumnarFileStore(os.path.join(directory, "store"))
+    store.prepare()
+    return store, lambda: shutil.rmtree(directory, ignore_errors=True)
+
+
+def fill_history(store, device_id, days, end_ts, step=60, chunk=10000, seed=0):
+    """Записывает историю за days суток до end_ts по всем датчикам; возвращает число строк."""
+    n_rows = days * 86400 // step
+    rng = np.random.default_rng(seed)
+    ts = end_ts - step * np.arange(n_rows, 0, -1)
+    written = 0
+    for sensor, base in zip(app.SENSORS, (22.0, 40.0, -5.0)):
+        values = base + rng.normal(0.0, 1.0, n_rows).cumsum() * 0.05
+        rows = [(device_id, sensor, float(v), int(t)) for t, v in zip(ts, values)]
+        for i in range(0, len(rows), chunk):
+            store.append(rows[i:i + chunk])
+        written += len(rows)
+    return written
+
+
+def make_messages(devices, count, payload_kind, seed=0):
+    """Список (топик, payload) в порядке публикации: устройства по кругу."""
+    rng = np.random.default_rng(seed)
+    metrics = list(app.METRICS.items())
+    messages = []
+    for i in range(count):
+        device_id = f"bench-{i % devices}"
+        seq = i // devices
+        if payload_kind == "batch":
+            values = {
+                "tempC": 22.0 + rng.normal(0.0, 0.5),
+                "Humidity": 40.0 + rng.normal(0.0, 2.0),
+                "q": -5.0 + rng.normal(0.0, 1.0),
+            }
+            messages.append((f"sensors/{device_id}/{BATCH}",
+                             payload.encode_batch(seq, seq * 10, values)))
+        else:
+            metric, _ = metrics[seq % len(metrics)]
+            messages.append((f"sensors/{device_id}/{metric}", f"{20.0 + rng.normal():.2f}".encode()))
+    return messages
+
+
+def run_ingest(handler, messages, rate):
+    """Публикует сообщения с заданной частотой (0 — без ограничения) и ждёт записи всего принятого."""
+    broker = BrokerStub(handler)
+    publish_times = []
+    start = time.perf_counter()
+    for i, (topic, data) in enumerate(messages):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        t0 = time.perf_counter()
+        broker.publish(topic, data)
+        publish_times.append(time.perf_counter() - t0)
+    published = time.perf_counter() - start
+    handler.writer.stop()
+    elapsed = time.perf_counter() - start
+    stats = handler.writer.stats()
+    return {
+        "messages": broker.published,
+        "publish_s": published,
+        "elapsed_s": elapsed,
+        "rows_written": stats["written"],
+        "rows_dropped": stats["dropped"],
+        "rows_per_s": stats["written"] / elapsed if elapsed else 0.0,
+        "on_message_p50_ms": percentile_ms(publish_times, 50),
+        "on_message_p99_ms": percentile_ms(publish_times, 99),
+        "flushes": stats["flushes"],
+        "flush_p50_ms": stats["p50_flush_ms"],
+        "flush_p99_ms": stats["p99_flush_ms"],
+        "flush_max_ms": stats["max_flush_ms"],
+    }
+
+
+async def press(bot, chat_id, data, chat_data):
+    start = time.perf_counter()
+    await app.button_handler(FakeUpdate(chat_id, data, bot), FakeContext(bot, chat_data))
+    return time.perf_counter() - start
+
+
+async def run_charts(periods, repeat, bot):
+    """Время нажатия кнопки периода: первый запрос строит график, повторные берут его из кэша."""
+    chat_data = {"device_id": CHART_DEVICE}
+    result = {}
+    for minutes in periods:
+        cold = await press(bot, 1, f"period:{minutes}", chat_data)
+        warm = [await press(bot, 1, f"period:{minutes}", chat_data) for _ in range(repeat)]
+        result[str(minutes)] = {
+            "cold_ms": cold * 1000.0,
+            "warm_p50_ms": percentile_ms(warm, 50),
+            "warm_p99_ms": percentile_ms(warm, 99),
+        }
+    return result
+
+
+async def run_concurrent_charts(periods, chats, bot):
+    """Одновременные запросы одного графика из многих чатов: single-flight строит его один раз."""
+    app.CHARTS = ChartCache(max_entries=app.CHART_CACHE_MAX_ENTRIES, max_bytes=app.CHART_CACHE_MAX_BYTES)
+    minutes = periods[-1]
+    start = time.perf_counter()
+    times = await asyncio.gather(*(
+        press(bot, chat_id, f"period:{minutes}", {"device_id": CHART_DEVICE})
+        for chat_id in range(1, chats + 1)
+    ))
+    return {
+        "period": minutes,
+        "chats": chats,
+        "total_ms": (time.perf_counter() - start) * 1000.0,
+        "p50_ms": percentile_ms(times, 50),
+        "p99_ms": percentile_ms(times, 99),
+        "renders": app.CHARTS.misses,
+    }
+
+
+async def run_alert(users, latency, per_second, png):
+    bot = FakeBot(latency=latency)
+    limiter = RateLimiter(per_second=per_second, chat_interval=0.0)
+    start = time.perf_counter()
+    delivered, failed = await broadcast_alert(
+        bot, range(1, users + 1), "Обнаружен резкий перепад", [png], limiter,
+        concurrency=app.ALERT_SEND_CONCURRENCY
+    )
+    return {
+        "users": users,
+        "delivered": delivered,
+        "failed": failed,
+        "total_ms": (time.perf_counter() - start) * 1000.0,
+        "messages_sent": sum(bot.calls.values()),
+        "photo_uploads": bot.uploads,
+    }
+
+
+async def run_bot(args):
+    bot = FakeBot(latency=args.bot_latency)
+    charts = await run_charts(args.periods, args.repeat, bot)
+    concurrent = await run_concurrent_charts(args.periods, args.chats, bot)
+    entry = await app.get_period_chart(app.SENSORS, args.periods[0], CHART_DEVICE)
+    alert = await run_alert(args.users, args.bot_latency, args.tg_rate, entry.png if entry else None)
+    return charts, concurrent, alert
+
+
+def print_report(results):
+    ingest = results["ingest"]
+    print(f"Приём: {ingest['rows_written']} строк за {ingest['elapsed_s']:.2f} с, "
+          f"{ingest['rows_per_s']:.0f} строк/с, отброшено {ingest['rows_dropped']}")
+    print(f"  on_message p50/p99: {ingest['on_message_p50_ms']:.3f} / {ingest['on_message_p99_ms']:.3f} мс")
+    print(f"  сброс пачки p50/p99: {ingest['flush_p50_ms']:.2f} / {ingest['flush_p99_ms']:.2f} мс "
+          f"({ingest['flushes']} сбросов)")
+    print(f"\n{'период, мин':>12} {'холодный, мс':>14} {'кэш p50, мс':>12} {'кэш p99, мс':>12}")
+    for minutes, chart in results["charts"].items():
+        print(f"{minutes:>12} {chart['cold_ms']:>14.1f} {chart['warm_p50_ms']:>12.2f} {chart['warm_p99_ms']:>12.2f}")
+    concurrent = results["concurrent_charts"]
+    print(f"\n{concurrent['chats']} чатов одновременно, период {concurrent['period']} мин: "
+          f"{concurrent['total_ms']:.1f} мс, p99 {concurrent['p99_ms']:.1f} мс, построений {concurrent['renders']}")
+    alert = results["alert"]
+    print(f"Рассылка алерта {alert['users']} пользователям: {alert['total_ms']:.1f} мс, "
+          f"доставлено {alert['delivered']}, ошибок {alert['failed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "columnar"], default="sqlite")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=0, help="сообщений в секунду суммарно, 0 — без ограничения")
+    parser.add_argument("--duration", type=float, default=None, help="длительность при заданной --rate, с")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--payload", choices=["batch", "text"], default="batch")
+    parser.add_argument("--batch-size", type=int, default=app.INGEST_BATCH_SIZE)
+    parser.add_argument("--flush-interval-ms", type=int, default=app.INGEST_FLUSH_INTERVAL_MS)
+    parser.add_argument("--overflow", choices=["block", "drop_oldest"], default="block",
+                        help="политика переполнения очереди записи; с block публикация ждёт запись, "
+                             "и строк/с — устойчивая скорость записи")
+    parser.add_argument("--history-days", type=int, default=30)
+    parser.add_argument("--periods", type=int, nargs="+", default=DEFAULT_PERIODS)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--bot-latency", type=float, default=0.02, help="задержка ответа поддельного Telegram, с")
+    parser.add_argument("--tg-rate", type=float, default=app.TELEGRAM_MESSAGES_PER_SECOND)
+    parser.add_argument("--render-pool", action="store_true", help="строить графики в пуле процессов")
+    parser.add_argument("--output", default=None, help="куда сохранить результат в JSON")
+    parser.add_argument("--compare", default=None, help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+    count = int(args.rate * args.duration) if args.rate and args.duration else args.messages
+
+    # Миграции и обработчики печатают каждое действие; в отчёт это не нужно
+    with contextlib.redirect_stdout(io.StringIO()):
+        store, cleanup = open_store(args.backend)
+    app.STORE = store
+    app.DB = AsyncSensorStore(store, max_workers=app.DB_READ_POOL_SIZE)
+    if args.render_pool:
+        app.RENDERER.start()
+        app.RENDERER.warm_up()
+    try:
+        history = fill_history(store, CHART_DEVICE, args.history_days, int(time.time()))
+        writer = IngestWriter(store, batch_size=args.batch_size, flush_interval_ms=args.flush_interval_ms,
+                              max_queue=app.INGEST_MAX_QUEUE, overflow=args.overflow,
+                              put_timeout=BLOCK_PUT_TIMEOUT, versions=app.DATA_VERSIONS)
+        handler = app.MQTTClientHandler(writer=writer)
+        messages = make_messages(args.devices, count, args.payload)
+        with contextlib.redirect_stdout(io.StringIO()):
+            writer.start()
+            ingest = run_ingest(handler, messages, args.rate)
+            charts, concurrent, alert = asyncio.run(run_bot(args))
+    finally:
+        app.RENDERER.shutdown()
+        app.DB.shutdown()
+        store.close()
+        cleanup()
+
+    result = {
+        "params": {**vars(args), "messages": count, "history_rows": history},
+        "environment": environment(),
+        "results": {
+            "ingest": ingest,
+            "charts": charts,
+            "concurrent_charts": concurrent,
+            "alert": alert,
+        },
+    }
+    print_report(result["results"])
+    if args.output:
+        save_result(result, args.output)
+    if args.compare:
+        compare(result, args.compare)
+    if ingest["rows_dropped"]:
+        # Часть показаний не записана: строк/с не равно устойчивой скорости записи
+        raise SystemExit(f"Отброшено {ingest['rows_dropped']} строк: результат приёма недействителен")
+
+if __name__ == "__main__":
+    main()
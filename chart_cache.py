@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+class DataVersions:
+    """
+    Счётчики версий данных по парам (устройство, датчик). IngestWriter увеличивает
+    счётчик после каждой записи показаний, поэтому ключ кэша с версией устаревает
+    сразу, как только в ряд пришли новые данные.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def bump(self, rows):
+        """Отмечает изменение рядов из пачки показаний (device_id, sensor, value, ts)."""
+        keys = {(row[0], row[1]) for row in rows}
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def get(self, device_id, sensor):
+        with self._lock:
+            return self._versions.get((device_id, sensor), 0)
+
+
+class ChartEntry:
+    def __init__(self, png, sensors=()):
+        self.png = png
+        # Датчики, попавшие на график (у остальных не было данных)
+        self.sensors = list(sensors)
+        # file_id после первой отправки: повторно график не загружается в Telegram
+        self.file_id = None
+
+
+class ChartCache:
+    """
+    LRU-кэш построенных графиков в цикле событий бота. Размер ограничен и числом
+    записей max_entries, и суммарным объёмом PNG max_bytes; при превышении
+    вытесняются давно не запрошенные графики.
+    Одновременные запросы одного ключа ждут одно построение (single-flight).
+    Пустой результат (None) не кэшируется.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    async def get_or_render(self, key, render):
+        """Возвращает ChartEntry для key; при промахе вызывает корутину render(), возвращающую ChartEntry или None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            entry = await render()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим, само будущее больше никто не прочитает
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        if entry is not None:
+            self._put(key, entry)
+        future.set_result(entry)
+        return entry
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self.size_bytes += len(entry.png)
+        while self._entries and (len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self.size_bytes -= len(evicted.png)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
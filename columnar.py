@@ -0,0 +1,141 @@
+import time
+
+import numpy as np
+
+# Сырые показания: метка времени (секунды Unix) и значение
+RAW_DTYPE = np.dtype([('ts', '<i8'), ('value', '<f8')])
+# Агрегаты: начало корзины, среднее, минимум и максимум
+ROLLUP_DTYPE = np.dtype([('ts', '<i8'), ('value', '<f8'), ('min', '<f8'), ('max', '<f8')])
+
+
+def keyed(dtype):
+    """dtype с дополнительным первым полем key — номером ряда в запросе сразу по нескольким датчикам."""
+    return np.dtype([('key', '<i4')] + [(name, dtype.fields[name][0]) for name in dtype.names])
+
+
+def fetch_array(cursor, dtype=RAW_DTYPE):
+    """
+    Собирает результат запроса прямо в структурированный массив NumPy,
+    без промежуточного списка кортежей и разбора строк с датами.
+    Порядок колонок в SELECT должен совпадать с полями dtype.
+    """
+    return np.fromiter(cursor, dtype=dtype)
+
+
+def split_keyed(array, count, dtype):
+    """
+    Делит результат запроса с полем key (упорядоченный по key) на count массивов dtype.
+    Возвращает список, i-й элемент — ряд с key == i.
+    """
+    bounds = np.searchsorted(array['key'], np.arange(count + 1))
+    parts = []
+    for i in range(count):
+        chunk = array[bounds[i]:bounds[i + 1]]
+        part = np.empty(len(chunk), dtype=dtype)
+        for name in dtype.names:
+            part[name] = chunk[name]
+        parts.append(part)
+    return parts
+
+
+def has_range(series):
+    return series.dtype.names is not None and 'min' in series.dtype.names
+
+
+def local_datetimes(ts):
+    """Переводит секунды Unix в datetime64[s] местного времени (как в текстовой колонке timestamp)."""
+    ts = np.asarray(ts, dtype='<i8')
+    if len(ts) == 0:
+        return ts.astype('datetime64[s]')
+    first = time.localtime(int(ts[0])).tm_gmtoff
+    last = time.localtime(int(ts[-1])).tm_gmtoff
+    if first == last:
+        offsets = first
+    else:
+        # Диапазон пересекает переход на летнее/зимнее время
+        offsets = np.fromiter((time.localtime(int(t)).tm_gmtoff for t in ts), dtype='<i8', count=len(ts))
+    return (ts + offsets).astype('datetime64[s]')
+
+
+def merge_series(old, new):
+    """
+    Объединяет два массива показаний, упорядочивая по ts. Показания old с теми же
+    метками времени, что есть в new, считаются уже учтёнными в new и отбрасываются.
+    """
+    old = old[~np.isin(old['ts'], new['ts'])]
+    merged = np.concatenate([old, new])
+    return merged[np.argsort(merged['ts'], kind='stable')]
+
+
+def aggregate(series, bucket_width):
+    """Сворачивает упорядоченный по ts массив RAW_DTYPE в корзины ROLLUP_DTYPE шириной bucket_width секунд."""
+    if len(series) == 0:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+    buckets = series['ts'] // bucket_width * bucket_width
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1])
+    counts = np.diff(np.append(starts, len(series)))
+    values = series['value']
+    result = np.empty(len(starts), dtype=ROLLUP_DTYPE)
+    result['ts'] = buckets[starts]
+    result['value'] = np.add.reduceat(values, starts) / counts
+    result['min'] = np.minimum.reduceat(values, starts)
+    result['max'] = np.maximum.reduceat(values, starts)
+    return result
+
+
+def m4(series, max_points):
+    """
+    Прореживание для графика (M4): диапазон времени делится на max_points // 4 равных
+    корзин, и в каждой остаются первое, последнее, минимальное и максимальное показание.
+    Линия по ним на экране совпадает с линией по всем точкам: выбросы не теряются.
+    Пропуски (NaN) не мешают найти крайние значения корзины. Массив не длиннее
+    max_points возвращается как есть; max_points должно быть не меньше 4.
+    """
+    n = len(series)
+    if n <= max_points:
+        return series
+    ts = series['ts']
+    values = series['value']
+    buckets = max(max_points // 4, 1)
+    span = int(ts[-1]) - int(ts[0]) + 1
+    bucket = ts - ts[0]
+    bucket *= buckets
+    bucket //= span
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(bucket)) + 1])
+    ends = np.append(starts[1:], n) - 1
+    # Первое вхождение минимума и максимума в каждой корзине; fmin/fmax пропускают NaN
+    extreme = np.empty(buckets)
+    extreme[bucket[starts]] = np.fmin.reduceat(values, starts)
+    min_idx = np.flatnonzero(values == extreme[bucket])
+    extreme[bucket[starts]] = np.fmax.reduceat(values, starts)
+    max_idx = np.flatnonzero(values == extreme[bucket])
+    min_idx = min_idx[np.unique(bucket[min_idx], return_index=True)[1]]
+    max_idx = max_idx[np.unique(bucket[max_idx], return_index=True)[1]]
+    keep = np.unique(np.concatenate([starts, ends, min_idx, max_idx]))
+    return series[keep]
+
+
+def thin_rollups(series, max_points):
+    """
+    Сливает соседние корзины массива ROLLUP_DTYPE, пока их не станет не больше max_points:
+    min и max корзины — крайние значения исходных, value — среднее их средних.
+    """
+    n = len(series)
+    if n <= max_points:
+        return series
+    step = -(-n // max_points)
+    starts = np.arange(0, n, step)
+    counts = np.diff(np.append(starts, n))
+    result = np.empty(len(starts), dtype=ROLLUP_DTYPE)
+    result['ts'] = series['ts'][starts]
+    result['value'] = np.add.reduceat(series['value'], starts) / counts
+    result['min'] = np.fmin.reduceat(series['min'], starts)
+    result['max'] = np.fmax.reduceat(series['max'], starts)
+    return result
+
+
+def downsample(series, max_points):
+    """Сокращает ряд любого вида до max_points точек для отрисовки (см. m4 и thin_rollups)."""
+    if has_range(series):
+        return thin_rollups(series, max_points)
+    return m4(series, max_points)
@@ -0,0 +1,104 @@
+import asyncio
+import datetime
+
+import metrics
+
+
+def _seconds(value):
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты отправки в Telegram: не больше per_second сообщений в секунду
+    суммарно и не чаще одного сообщения в chat_interval секунд в один чат.
+    Каждый вызов резервирует себе слот времени, поэтому блокировка не держится во время ожидания.
+    """
+
+    def __init__(self, per_second=30, chat_interval=1.0):
+        self.interval = 1.0 / per_second
+        self.chat_interval = chat_interval
+        self._lock = asyncio.Lock()
+        self._next_global = 0.0
+        self._next_chat = {}
+
+    async def acquire(self, chat_id):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            slot = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+            self._next_global = max(self._next_global, now) + self.interval
+            self._next_chat[chat_id] = slot + self.chat_interval
+            if len(self._next_chat) > 10000:
+                self._next_chat = {k: v for k, v in self._next_chat.items() if v > now}
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Сдвигает все отправки после ответа Telegram о флуд-контроле."""
+        loop = asyncio.get_running_loop()
+        self._next_global = max(self._next_global, loop.time() + seconds)
+
+
+async def send_with_retry(limiter, chat_id, method, max_retries=3, **kwargs):
+    # telegram загружается при первой отправке, а не при импорте модуля
+    from telegram.error import RetryAfter
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(chat_id)
+        try:
+            with metrics.timed(metrics.TELEGRAM_SECONDS, errors=metrics.TELEGRAM_ERRORS, method=method.__name__):
+                return await method(chat_id=chat_id, **kwargs)
+        except RetryAfter as e:
+            if attempt == max_retries:
+                raise
+            delay = _seconds(e.retry_after)
+            print(f"Флуд-контроль Telegram, повтор через {delay:.1f} с")
+            limiter.pause(delay)
+
+
+async def broadcast_alert(bot, chat_ids, text, photos, limiter, concurrency=20):
+    """
+    Рассылает текст и готовые графики (PNG bytes) всем получателям.
+    Графики загружаются в Telegram один раз: file_id из первой успешной отправки
+    используется для остальных получателей. Получатели обслуживаются параллельно,
+    внутри одного чата порядок сообщений сохраняется.
+    Возвращает (число доставленных, число ошибок).
+    """
+    from telegram.error import Forbidden, BadRequest
+    photos = [png for png in photos if png]
+    file_ids = [None] * len(photos)
+    delivered = 0
+    failed = 0
+
+    async def deliver(chat_id):
+        nonlocal delivered, failed
+        try:
+            await send_with_retry(limiter, chat_id, bot.send_message, text=text)
+            for i, png in enumerate(photos):
+                message = await send_with_retry(limiter, chat_id, bot.send_photo, photo=file_ids[i] or png)
+                if file_ids[i] is None and message is not None and message.photo:
+                    file_ids[i] = message.photo[-1].file_id
+            delivered += 1
+        except (Forbidden, BadRequest) as e:
+            failed += 1
+            print(f"Не удалось доставить алерт пользователю {chat_id}: {e}")
+        except Exception as e:
+            failed += 1
+            print(f"Ошибка отправки алерта пользователю {chat_id}:", e)
+
+    pending = list(chat_ids)
+    # Первые отправки идут по одной, пока не получены file_id всех графиков
+    while pending and any(file_id is None for file_id in file_ids):
+        await deliver(pending.pop(0))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver_limited(chat_id):
+        async with semaphore:
+            await deliver(chat_id)
+
+    await asyncio.gather(*(deliver_limited(chat_id) for chat_id in pending))
+    return delivered, failed
@@ -0,0 +1,160 @@
+import asyncio
+import math
+import threading
+from collections import deque
+
+from schema import DEFAULT_DEVICE
+
+
+class EwmaDetector:
+    """
+    Потоковый детектор перепадов для одного датчика.
+
+    Держит экспоненциально взвешенные среднее и дисперсию (EWMA) и на каждое новое
+    показание за O(1) решает, является ли оно резким перепадом: отклонение от
+    среднего должно превышать и абсолютный порог threshold, и z_threshold
+    стандартных отклонений. Первые warmup показаний только обучают статистику.
+    Аномальное показание входит в статистику, поэтому следующий перепад
+    сравнивается уже с новым уровнем.
+    """
+
+    def __init__(self, threshold, alpha=0.2, z_threshold=3.0, warmup=4):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.mean = None
+        self.var = 0.0
+        self.count = 0
+
+    def update(self, value):
+        """Возвращает отклонение от среднего, если показание — перепад, иначе None."""
+        self.count += 1
+        if self.mean is None:
+            self.mean = value
+            return None
+        diff = value - self.mean
+        std = math.sqrt(self.var)
+        spike = (
+            self.count > self.warmup
+            and abs(diff) > self.threshold
+            and abs(diff) > self.z_threshold * std
+        )
+        # Обновление EWMA-среднего и дисперсии (West, 1979)
+        incr = self.alpha * diff
+        self.mean += incr
+        self.var = (1 - self.alpha) * (self.var + diff * incr)
+        return diff if spike else None
+
+
+class AlertEvent:
+    def __init__(self, sensor, value, diff, ts, mean, device_id=DEFAULT_DEVICE):
+        self.device_id = device_id
+        self.sensor = sensor
+        self.value = value
+        self.diff = diff
+        self.ts = ts
+        self.mean = mean
+
+
+class StreamingDetector:
+    """
+    Набор детекторов по парам (устройство, датчик), вызываемый из MQTT-обработчика на каждое показание.
+    Обнаруженные перепады кладутся в asyncio.Queue цикла событий бота
+    (через call_soon_threadsafe, так как вызов идёт из потока MQTT).
+    Пороги задаются по типу датчика и общие для всех устройств.
+    Повторные алерты по одному датчику устройства подавляются на cooldown секунд
+    после подтверждённого алерта: потребитель очереди решает, отправлять ли перепад
+    (например, внешняя температура сверяется с API погоды), проверяет ready() и после
+    отправки вызывает confirm(). Отвергнутый перепад не мешает следующему.
+    Перепады, обнаруженные до attach() (приём MQTT запускается раньше бота),
+    копятся в буфере и попадают в очередь при привязке к циклу событий.
+    """
+
+    def __init__(self, thresholds, alpha=0.2, z_threshold=3.0, cooldown=300, max_queue=1000):
+        self.thresholds = thresholds
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.cooldown = cooldown
+        self.max_queue = max_queue
+        self._detectors = {}
+        self._last_alert = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self.queue = None
+        self._pending = deque()
+        self.dropped = 0
+
+    def attach(self, loop):
+        """Привязывает очередь алертов к циклу событий бота и переносит в неё накопленные перепады."""
+        queue = asyncio.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self.queue = queue
+            self._loop = loop
+            # Под блокировкой: новые перепады встанут в очередь после накопленных
+            for event in self._pending:
+                loop.call_soon_threadsafe(self._put, event)
+            self._pending.clear()
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def observe(self, sensor, value, ts, device_id=DEFAULT_DEVICE):
+        threshold = self.thresholds.get(sensor)
+        if threshold is None:
+            return None
+        key = (device_id, sensor)
+        with self._lock:
+            detector = self._detectors.get(key)
+            if detector is None:
+                detector = self._detectors[key] = EwmaDetector(
+                    threshold, alpha=self.alpha, z_threshold=self.z_threshold
+                )
+            mean = detector.mean
+            diff = detector.update(value)
+            if diff is None:
+                return None
+            if self._cooling_down(key, ts):
+                return None
+            event = AlertEvent(sensor, value, diff, ts, mean, device_id)
+            loop = self._loop
+            if loop is None:
+                # Бот ещё не запущен: перепад дождётся attach()
+                if len(self._pending) >= self.max_queue:
+                    self.dropped += 1
+                    return None
+                self._pending.append(event)
+            elif loop.is_closed():
+                return None
+        if loop is not None:
+            loop.call_soon_threadsafe(self._put, event)
+        return event
+
+    def _cooling_down(self, key, ts):
+        return ts - self._last_alert.get(key, -math.inf) < self.cooldown
+
+    def ready(self, event):
+        """Можно ли отправлять перепад: после подтверждённого алерта по датчику прошло cooldown секунд."""
+        with self._lock:
+            return not self._cooling_down((event.device_id, event.sensor), event.ts)
+
+    def confirm(self, event):
+        """Отмечает, что алерт по перепаду отправлен: с его времени начинается подавление повторов."""
+        key = (event.device_id, event.sensor)
+        with self._lock:
+            self._last_alert[key] = max(event.ts, self._last_alert.get(key, -math.inf))
+
+    def warm(self, sensor, values, device_id=DEFAULT_DEVICE):
+        """Обучает статистику на исторических значениях (от старых к новым) без генерации алертов."""
+        threshold = self.thresholds.get(sensor)
+        if threshold is None:
+            return
+        with self._lock:
+            detector = self._detectors[(device_id, sensor)] = EwmaDetector(
+                threshold, alpha=self.alpha, z_threshold=self.z_threshold
+            )
+            for value in values:
+                detector.update(value)
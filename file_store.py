@@ -0,0 +1,193 @@
+import os
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+import columnar
+from schema import format_timestamp, DEFAULT_DEVICE
+from sensor_store import SensorStore
+
+# Одна запись разреженного индекса на каждые INDEX_STRIDE показаний ряда
+INDEX_STRIDE = 1024
+INDEX_DTYPE = np.dtype([('ts', '<i8'), ('pos', '<i8')])
+
+DATA_FILE = "data.bin"
+INDEX_FILE = "index.bin"
+# Файл-метка: в ряд дописывались показания не по порядку времени
+UNSORTED_FILE = "unsorted"
+
+
+class SeriesFile:
+    """
+    Один ряд (устройство, датчик): файл записей columnar.RAW_DTYPE, только дозапись,
+    и разреженный индекс (ts, номер записи) для каждой INDEX_STRIDE-й записи.
+    Пока показания приходят по возрастанию времени, выборка диапазона читает
+    только нужные блоки; иначе ряд помечается unsorted и читается целиком.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.data_path = os.path.join(directory, DATA_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.unsorted_path = os.path.join(directory, UNSORTED_FILE)
+        self.count = self._stored_count()
+        self.sorted = not os.path.exists(self.unsorted_path)
+        last = self._read(self.count - 1, self.count) if self.count else None
+        self.last_ts = int(last['ts'][0]) if last is not None and len(last) else None
+
+    def _stored_count(self):
+        try:
+            return os.path.getsize(self.data_path) // columnar.RAW_DTYPE.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def _read(self, start, stop):
+        """Записи [start, stop) — представление на отображённый в память файл, без копирования."""
+        if stop <= start:
+            return np.empty(0, dtype=columnar.RAW_DTYPE)
+        return np.memmap(self.data_path, dtype=columnar.RAW_DTYPE, mode='r',
+                         offset=start * columnar.RAW_DTYPE.itemsize, shape=(stop - start,))
+
+    def append(self, series):
+        """Дописывает массив RAW_DTYPE; вызывается под блокировкой хранилища."""
+        os.makedirs(self.directory, exist_ok=True)
+        series = series[np.argsort(series['ts'], kind='stable')]
+        if self.sorted and self.last_ts is not None and series['ts'][0] < self.last_ts:
+            open(self.unsorted_path, "w").close()
+            self.sorted = False
+        with open(self.data_path, "ab") as f:
+            f.write(series.tobytes())
+        first = -(-self.count // INDEX_STRIDE) * INDEX_STRIDE
+        positions = np.arange(first, self.count + len(series), INDEX_STRIDE)
+        if len(positions):
+            index = np.empty(len(positions), dtype=INDEX_DTYPE)
+            index['ts'] = series['ts'][positions - self.count]
+            index['pos'] = positions
+            # Индекс пишется после данных, поэтому никогда не ссылается дальше конца файла
+            with open(self.index_path, "ab") as f:
+                f.write(index.tobytes())
+        self.count += len(series)
+        last_ts = int(series['ts'][-1])
+        self.last_ts = last_ts if self.last_ts is None else max(self.last_ts, last_ts)
+
+    def _read_index(self, count):
+        """Записи индекса, относящиеся к первым count показаниям (запись может идти параллельно)."""
+        if not count:
+            return np.empty(0, dtype=INDEX_DTYPE)
+        entries = min(os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize, -(-count // INDEX_STRIDE))
+        with open(self.index_path, "rb") as f:
+            return np.fromfile(f, dtype=INDEX_DTYPE, count=entries)
+
+    def range(self, start_ts, end_ts):
+        count = self.count
+        if not self.sorted:
+            series = self._read(0, count)
+            series = series[(series['ts'] >= start_ts) & (series['ts'] <= end_ts)]
+            return series[np.argsort(series['ts'], kind='stable')]
+        index = self._read_index(count)
+        # Блок перед первой записью индекса с ts >= start_ts может содержать начало диапазона
+        first_block = max(np.searchsorted(index['ts'], start_ts, side='left') - 1, 0)
+        last_block = np.searchsorted(index['ts'], end_ts, side='right')
+        start = int(index['pos'][first_block]) if len(index) else 0
+        stop = int(index['pos'][last_block]) if last_block < len(index) else count
+        series = self._read(start, stop)
+        lo = np.searchsorted(series['ts'], start_ts, side='left')
+        hi = np.searchsorted(series['ts'], end_ts, side='right')
+        return series[lo:hi]
+
+    def tail(self, n):
+        count = self.count
+        if self.sorted:
+            return self._read(max(count - n, 0), count)
+        series = self._read(0, count)
+        return series[np.argsort(series['ts'], kind='stable')][-n:]
+
+
+class ColumnarFileStore(SensorStore):
+    """
+    Хранилище для большого потока показаний: каталог root/<device_id>/<sensor>/
+    с файлами SeriesFile, без SQL и транзакций. Запись — дозапись в конец файлов,
+    выборка — чтение нужных блоков по разреженному индексу. Агрегаты считаются
+    по сырым данным при запросе (columnar.aggregate). Пользователи бота
+    хранятся в root/users.txt, по одному chat_id в строке.
+    """
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+        self.users_path = os.path.join(root, "users.txt")
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def prepare(self):
+        os.makedirs(self.root, exist_ok=True)
+
+    def _get(self, device_id, sensor):
+        key = (device_id, sensor)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = SeriesFile(os.path.join(self.root, device_id, sensor))
+        return series
+
+    def append(self, rows):
+        groups = defaultdict(list)
+        for device_id, sensor, value, ts in rows:
+            groups[(device_id, sensor)].append((ts, value))
+        with self.timed("append"), self._lock:
+            for (device_id, sensor), values in groups.items():
+                self._get(device_id, sensor).append(np.array(values, dtype=columnar.RAW_DTYPE))
+
+    def latest(self, sensor, device_id=DEFAULT_DEVICE):
+        series = self.tail(sensor, 1, device_id)
+        if not len(series):
+            return None
+        return float(series['value'][-1]), format_timestamp(int(series['ts'][-1]))
+
+    def range(self, sensor, start_ts, end_ts, device_id=DEFAULT_DEVICE):
+        with self.timed("range"):
+            with self._lock:
+                series = self._get(device_id, sensor)
+            return series.range(start_ts, end_ts)
+
+    def tail(self, sensor, n, device_id=DEFAULT_DEVICE):
+        with self.timed("tail"):
+            with self._lock:
+                series = self._get(device_id, sensor)
+            return series.tail(n)
+
+    def aggregate(self, sensor, start_ts, end_ts, bucket_width, device_id=DEFAULT_DEVICE):
+        with self.timed("aggregate"):
+            return columnar.aggregate(self.range(sensor, start_ts, end_ts, device_id), bucket_width)
+
+    def devices(self):
+        with self.timed("devices"):
+            last_seen = {}
+            for device_id in os.listdir(self.root):
+                directory = os.path.join(self.root, device_id)
+                if not os.path.isdir(directory):
+                    continue
+                with self._lock:
+                    seen = [self._get(device_id, sensor).last_ts for sensor in os.listdir(directory)]
+                seen = [ts for ts in seen if ts is not None]
+                if seen:
+                    last_seen[device_id] = max(seen)
+            return sorted(last_seen, key=last_seen.get, reverse=True)
+
+    def add_user(self, chat_id):
+        with self.timed("add_user"), self._lock:
+            if chat_id in self._read_users():
+                return
+            with open(self.users_path, "a") as f:
+                f.write(f"{chat_id}\n")
+
+    def _read_users(self):
+        try:
+            with open(self.users_path) as f:
+                return [int(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def users(self):
+        with self.timed("users"), self._lock:
+            return self._read_users()
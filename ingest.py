@@ -0,0 +1,195 @@
+import sqlite3
+import threading
+import time
+import traceback
+from collections import deque
+
+import numpy as np
+
+import metrics
+from schema import DEFAULT_DEVICE
+
+
+class IngestWriter:
+    """
+    Фоновая запись показаний в хранилище (sensor_store.SensorStore).
+
+    Показания складываются в ограниченную очередь в памяти, а отдельный поток
+    сбрасывает её одним вызовом store.append — каждые batch_size строк или
+    каждые flush_interval_ms миллисекунд, смотря что наступит раньше.
+    После записи увеличиваются версии данных versions (chart_cache.DataVersions).
+
+    Ошибка хранилища (sqlite3.Error, OSError) считается временной: пачка возвращается
+    в очередь и записывается повторно. Любое другое исключение (например, от
+    некорректной строки) печатается с трассировкой, пачка отбрасывается, а поток
+    продолжает работу; оба случая учитываются в write_errors.
+
+    Если диск не успевает, поведение задаётся overflow:
+      - "drop_oldest" — самое старое показание выбрасывается из очереди;
+      - "block" — вызывающий поток ждёт до put_timeout секунд, затем
+        новое показание отбрасывается.
+    """
+
+    def __init__(self, store, batch_size=500, flush_interval_ms=1000,
+                 max_queue=10000, overflow="drop_oldest", put_timeout=1.0, versions=None):
+        if overflow not in ("drop_oldest", "block"):
+            raise ValueError(f"Неизвестная политика переполнения: {overflow}")
+        self.store = store
+        self.versions = versions
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.write_errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        # Длительности последних сбросов для перцентилей
+        self.recent_flush_ms = deque(maxlen=1024)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def put(self, sensor, value, ts=None, device_id=DEFAULT_DEVICE):
+        return self.put_many([(sensor, value)], ts, device_id) == 1
+
+    def put_many(self, readings, ts=None, device_id=DEFAULT_DEVICE):
+        """
+        Ставит в очередь несколько показаний (датчик, значение) одного момента времени
+        под одной блокировкой, поэтому они попадают в один executemany.
+        Возвращает число принятых показаний.
+        """
+        if ts is None:
+            ts = int(time.time())
+        accepted = 0
+        deadline = None
+        with self._cond:
+            for sensor, value in readings:
+                self.received += 1
+                if len(self._queue) >= self.max_queue:
+                    if self.overflow == "drop_oldest":
+                        self._queue.popleft()
+                        self.dropped += 1
+                    else:
+                        if deadline is None:
+                            deadline = time.monotonic() + self.put_timeout
+                        while len(self._queue) >= self.max_queue:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0 or not self._running:
+                                break
+                            self._cond.wait(remaining)
+                        if len(self._queue) >= self.max_queue:
+                            self.dropped += 1
+                            continue
+                self._queue.append((device_id, sensor, value, ts))
+                accepted += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return accepted
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "received": self.received,
+                "written": self.written,
+                "dropped": self.dropped,
+                "flushes": self.flushes,
+                "write_errors": self.write_errors,
+                "last_flush_ms": self.last_flush_ms,
+                "max_flush_ms": self.max_flush_ms,
+                "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+                "p50_flush_ms": self._percentile(50),
+                "p99_flush_ms": self._percentile(99),
+            }
+
+    def _percentile(self, q):
+        if not self.recent_flush_ms:
+            return 0.0
+        return float(np.percentile(self.recent_flush_ms, q))
+
+    def _take_batch(self):
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while self._running and len(self._queue) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            n = min(len(self._queue), self.batch_size)
+            batch = [self._queue.popleft() for _ in range(n)]
+            if batch:
+                # Освободилось место — будим производителей в режиме "block"
+                self._cond.notify_all()
+            return batch
+
+    def _requeue(self, batch):
+        with self._cond:
+            free = self.max_queue - len(self._queue)
+            if free < len(batch):
+                self.dropped += len(batch) - free
+                batch = batch[len(batch) - free:] if free > 0 else []
+            self._queue.extendleft(reversed(batch))
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        self.store.append(batch)
+        if self.versions is not None:
+            self.versions.bump(batch)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        with self._cond:
+            self.written += len(batch)
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.total_flush_ms += elapsed_ms
+            self.recent_flush_ms.append(elapsed_ms)
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        metrics.INGEST_ROWS.inc(len(batch))
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                try:
+                    self._write(batch)
+                except (sqlite3.Error, OSError) as e:
+                    print("Ошибка записи пачки показаний в БД:", e)
+                    with self._cond:
+                        self.write_errors += 1
+                    if not self._running:
+                        break
+                    self._requeue(batch)
+                    time.sleep(self.flush_interval)
+                except Exception:
+                    # Повтор той же пачки упадёт так же, поэтому она отбрасывается
+                    print(f"Непредвиденная ошибка записи пачки из {len(batch)} показаний, пачка отброшена:")
+                    traceback.print_exc()
+                    with self._cond:
+                        self.write_errors += 1
+                        self.dropped += len(batch)
+            elif not self._running:
+                break
@@ -0,0 +1,285 @@
+import functools
+import inspect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм длительности, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Пока метрики выключены, timed и inc сразу возвращаются и ничего не считают
+ENABLED = False
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик; метки передаются именованными аргументами inc."""
+
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Распределение значений (обычно длительностей в секундах) по корзинам buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # Метки -> [счётчики по корзинам, сумма, число наблюдений]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    result.append((self.name + "_bucket", key + (("le", _format_value(float(bound))),), cumulative))
+                result.append((self.name + "_bucket", key + (("le", "+Inf"),), count))
+                result.append((self.name + "_sum", key, total))
+                result.append((self.name + "_count", key, count))
+        return result
+
+
+class Gauge:
+    """
+    Значение, которое считывается в момент запроса /metrics: func возвращает число
+    или словарь значение метки label -> число (например, stats() кэша).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, func, label="stat"):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.label = label
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            return [
+                (self.name, ((self.label, key),), item)
+                for key, item in value.items()
+                if isinstance(item, (int, float)) and not isinstance(item, bool)
+            ]
+        return [(self.name, (), value)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def gauge(self, name, help, func, label="stat"):
+        return self.register(Gauge(name, help, func, label))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                print(f"Ошибка чтения метрики {metric.name}:", e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+MQTT_MESSAGES = REGISTRY.counter(
+    "smarttemp_mqtt_messages_total", "Сообщения MQTT по типу и результату разбора")
+INGEST_ROWS = REGISTRY.counter(
+    "smarttemp_ingest_rows_total", "Показания, записанные IngestWriter")
+INGEST_ENQUEUE_SECONDS = REGISTRY.histogram(
+    "smarttemp_ingest_enqueue_seconds", "Постановка показаний в очередь записи")
+DB_SECONDS = REGISTRY.histogram(
+    "smarttemp_db_seconds", "Операции хранилища показаний по имени")
+QUERY_SECONDS = REGISTRY.histogram(
+    "smarttemp_query_seconds", "Выборки данных для бота, включая ожидание пула потоков")
+RENDER_SECONDS = REGISTRY.histogram(
+    "smarttemp_render_seconds", "Построение графиков по виду и периоду, минуты")
+WEATHER_SECONDS = REGISTRY.histogram(
+    "smarttemp_weather_seconds", "Получение внешней температуры (вызов и запрос к API)")
+WEATHER_ERRORS = REGISTRY.counter(
+    "smarttemp_weather_errors_total", "Неудачные запросы к API погоды")
+TELEGRAM_SECONDS = REGISTRY.histogram(
+    "smarttemp_telegram_seconds", "Вызовы API Telegram по методу")
+TELEGRAM_ERRORS = REGISTRY.counter(
+    "smarttemp_telegram_errors_total", "Ошибки вызовов API Telegram по методу и типу")
+
+
+class timed:
+    """
+    Замер длительности в гистограмму histogram с метками labels.
+    Работает как контекстный менеджер (with timed(...):) и как декоратор
+    обычных и async-функций. Если задан errors, исключения считаются в этом
+    счётчике с теми же метками и меткой error — именем класса исключения.
+    """
+
+    def __init__(self, histogram, errors=None, **labels):
+        self.histogram = histogram
+        self.errors = errors
+        self.labels = labels
+        self._start = None
+
+    def __enter__(self):
+        if ENABLED:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._start is not None:
+            self._observe(self._start, exc_type)
+            self._start = None
+        return False
+
+    def _observe(self, start, exc_type=None):
+        self.histogram.observe(time.perf_counter() - start, **self.labels)
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc(error=exc_type.__name__, **self.labels)
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException as e:
+                    self._observe(start, type(e))
+                    raise
+                self._observe(start)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                self._observe(start, type(e))
+                raise
+            self._observe(start)
+            return result
+        return wrapper
+
+
+class MetricsServer:
+    """HTTP-сервер в фоновом потоке: GET /metrics отдаёт REGISTRY.render()."""
+
+    def __init__(self, host="127.0.0.1", port=9108, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+
+    def start(self):
+        if self._server is not None:
+            return
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,82 @@
+import math
+import struct
+import threading
+
+# Пакетное сообщение ESP8266 (топик sensors/<device_id>/batch), little-endian:
+#   uint8   версия формата (PAYLOAD_VERSION)
+#   uint32  порядковый номер сообщения, с 0 после каждой перезагрузки платы
+#   uint32  время работы платы в секундах (millis() / 1000)
+#   float32 значения датчиков в порядке PAYLOAD_SENSORS, NaN — датчик не прочитан
+PAYLOAD_VERSION = 1
+PAYLOAD_SENSORS = ("tempC", "Humidity", "q")
+PAYLOAD_STRUCT = struct.Struct("<BII" + "f" * len(PAYLOAD_SENSORS))
+
+
+class BatchPayload:
+    def __init__(self, seq, uptime, readings):
+        self.seq = seq
+        self.uptime = uptime
+        self.readings = readings
+
+
+def encode_batch(seq, uptime, values):
+    """Собирает пакет так же, как скетч; values — словарь датчик -> значение."""
+    return PAYLOAD_STRUCT.pack(
+        PAYLOAD_VERSION, seq, uptime,
+        *(values.get(sensor, math.nan) for sensor in PAYLOAD_SENSORS)
+    )
+
+
+def decode_batch(data):
+    """Разбирает пакет в BatchPayload; readings — список (датчик, значение) без непрочитанных датчиков."""
+    if len(data) != PAYLOAD_STRUCT.size:
+        raise ValueError(f"Неверная длина пакета: {len(data)} байт")
+    version, seq, uptime, *values = PAYLOAD_STRUCT.unpack(data)
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"Неизвестная версия пакета: {version}")
+    readings = [(sensor, value) for sensor, value in zip(PAYLOAD_SENSORS, values) if math.isfinite(value)]
+    return BatchPayload(seq, uptime, readings)
+
+
+class SequenceTracker:
+    """
+    Следит за порядковыми номерами пакетов каждого устройства.
+    Повтор уже полученного номера — дубликат (например, повторная доставка QoS 1),
+    такой пакет нужно отбросить. Скачок номера вперёд больше чем на 1 — потеря пакетов,
+    пропущенные номера суммируются в gaps. Уменьшение времени работы платы означает
+    перезагрузку, счёт номеров начинается заново.
+    """
+
+    def __init__(self):
+        self._last = {}
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.duplicates = 0
+        self.gaps = 0
+        self.restarts = 0
+
+    def check(self, device_id, seq, uptime):
+        """Возвращает False, если пакет — дубликат."""
+        with self._lock:
+            last = self._last.get(device_id)
+            if last is not None:
+                last_seq, last_uptime = last
+                if uptime < last_uptime:
+                    self.restarts += 1
+                elif seq <= last_seq:
+                    self.duplicates += 1
+                    return False
+                else:
+                    self.gaps += seq - last_seq - 1
+            self._last[device_id] = (seq, uptime)
+            self.accepted += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "duplicates": self.duplicates,
+                "gaps": self.gaps,
+                "restarts": self.restarts,
+            }
@@ -0,0 +1,190 @@
+import io
+import os
+import asyncio
+import textwrap
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import columnar
+
+# Сколько точек ряда рисовать на пиксель ширины картинки; None — рисовать все
+POINTS_PER_PIXEL = 2
+# Маркеры точек рисуются только на коротких рядах, где они читаются
+MARKER_MAX_POINTS = 200
+
+
+def _init_worker():
+    # Загружаем matplotlib заранее, чтобы первый график не ждал импорта и кэша шрифтов
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: F401
+
+
+def _noop():
+    pass
+
+
+def _new_figure(figsize=(10, 5)):
+    """Создаёт фигуру через объектный API Agg, без глобального состояния pyplot."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _plot_limit(fig):
+    """Число точек ряда, до которого прореживать график шириной с фигуру fig, или None."""
+    if POINTS_PER_PIXEL is None:
+        return None
+    return int(fig.get_figwidth() * fig.dpi * POINTS_PER_PIXEL)
+
+
+def _prepare(fig, series):
+    limit = _plot_limit(fig)
+    if limit is None:
+        return series
+    return columnar.downsample(series, limit)
+
+
+def _marker(series):
+    return 'o' if len(series) <= MARKER_MAX_POINTS else None
+
+
+def _to_png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def render_graph(series, sensor, color="black"):
+    """
+    Строит график показаний датчика и возвращает PNG в виде bytes.
+    series — структурированный массив columnar.RAW_DTYPE или columnar.ROLLUP_DTYPE.
+    """
+    if series is None or len(series) == 0:
+        return None
+    fig = _new_figure()
+    ax = fig.add_subplot()
+    _plot_series(ax, series, color)
+    ax.set_title(f'Изменение показаний {sensor}')
+    ax.set_xlabel('Время')
+    ax.set_ylabel('Значение')
+    ax.grid(True)
+    return _to_png(fig)
+
+
+def render_alert_graph(series, sensor, alert_message, color="black"):
+    """Строит график с аннотацией обнаруженного перепада и возвращает PNG в виде bytes."""
+    if series is None or len(series) == 0:
+        return None
+    fig = _new_figure()
+    ax = fig.add_subplot()
+    # Прореживание сохраняет последнее показание, к которому привязана аннотация
+    series = _prepare(fig, series)
+    timestamps = columnar.local_datetimes(series['ts'])
+    values = series['value']
+    ax.plot(timestamps, values, marker=_marker(series), linestyle='-', label=sensor, color=color)
+    ax.set_title(f'Изменение показаний {sensor} с обнаруженным перепадом')
+    ax.set_xlabel('Время')
+    ax.set_ylabel('Значение')
+    ax.grid(True)
+    _annotate_alert(ax, timestamps[-1], values[-1], alert_message)
+    ax.legend()
+    return _to_png(fig)
+
+
+def _plot_series(ax, series, color):
+    """Рисует ряд, предварительно сократив его до POINTS_PER_PIXEL точек на пиксель ширины."""
+    series = _prepare(ax.figure, series)
+    timestamps = columnar.local_datetimes(series['ts'])
+    if columnar.has_range(series):
+        # Агрегированные данные: среднее по корзине и полоса min..max
+        ax.fill_between(timestamps, series['min'], series['max'],
+                        color=color, alpha=0.2, linewidth=0)
+        ax.plot(timestamps, series['value'], color=color)
+    else:
+        ax.plot(timestamps, series['value'], marker=_marker(series), color=color)
+    return timestamps, series['value']
+
+
+def _annotate_alert(ax, x, y, alert_message):
+    ax.annotate(
+        textwrap.fill(alert_message, width=30),
+        xy=(x, y),
+        xycoords='data',
+        xytext=(-150, 20),
+        textcoords='offset points',
+        arrowprops=dict(facecolor='red', shrink=0.05),
+        fontsize=12,
+        color='red',
+        ha='right'
+    )
+
+
+def render_panels(panels, title):
+    """
+    Строит одну картинку с графиками нескольких датчиков друг под другом на общей оси времени
+    и возвращает PNG в виде bytes. panels — список (sensor, series, color, alert_message),
+    alert_message — None или текст аннотации к последней точке. Пустые ряды пропускаются.
+    """
+    panels = [panel for panel in panels if panel[1] is not None and len(panel[1])]
+    if not panels:
+        return None
+    fig = _new_figure(figsize=(10, 1 + 3 * len(panels)))
+    axes = fig.subplots(len(panels), 1, sharex=True, squeeze=False)[:, 0]
+    for ax, (sensor, series, color, alert_message) in zip(axes, panels):
+        timestamps, values = _plot_series(ax, series, color)
+        ax.set_ylabel(sensor)
+        ax.grid(True)
+        if alert_message:
+            _annotate_alert(ax, timestamps[-1], values[-1], alert_message)
+    axes[-1].set_xlabel('Время')
+    fig.suptitle(title)
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+class RenderService:
+    """
+    Пул процессов для построения графиков. Обработчики бота ждут результат через
+    await, поэтому отрисовка не блокирует цикл событий, а несколько тяжёлых
+    графиков строятся параллельно на разных ядрах.
+    Пока пул не запущен, графики строятся в текущем процессе.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+
+    def warm_up(self):
+        """
+        Запускает загрузку matplotlib в фоне, не дожидаясь её: все процессы пула
+        стартуют сразу (иначе они создаются при первых графиках), а без пула
+        модули импортируются в отдельном потоке.
+        """
+        if self._executor is None:
+            threading.Thread(target=_init_worker, name="render-warm-up", daemon=True).start()
+            return
+        for _ in range(self.max_workers or os.cpu_count() or 1):
+            self._executor.submit(_noop)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, func, *args):
+        if self._executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import columnar
+import storage
+from segments import SegmentStore, day_name, DAY
+
+
+class RetentionEngine:
+    """
+    Уплотнитель: переносит закрытые дни сырых показаний из SQLite в сегменты.
+
+    Сырые строки старше raw_days дней записываются в сегменты SegmentStore
+    archive_dir/<device_id>/<sensor>/<YYYY-MM-DD>.npy (по UTC-дням) и удаляются из
+    sensor_data; горячие данные остаются в SQLite. Таблицы агрегатов не трогаются:
+    они обновляются при записи и остаются основным источником для длинных периодов.
+
+    Работа идёт по одному дню за раз, удаление — пачками по batch_rows строк
+    в коротких транзакциях с паузой pause секунд между ними, чтобы не держать
+    блокировку записи и не задерживать IngestWriter. Если процесс упадёт между
+    записью файла и удалением строк, при следующем проходе файл будет дописан без повторов.
+    """
+
+    def __init__(self, db_file, archive_dir, raw_days=30, batch_rows=2000, interval=3600, pause=0.05):
+        self.db_file = db_file
+        self.archive_dir = archive_dir
+        self.raw_days = raw_days
+        self.batch_rows = batch_rows
+        self.interval = interval
+        self.pause = pause
+        self.segments = SegmentStore(archive_dir)
+        self._stop = threading.Event()
+        self._thread = None
+        self.archived = 0
+        self.runs = 0
+        self.errors = 0
+
+    def cutoff(self, now=None):
+        """Граница хранения сырых данных, выровненная по началу UTC-дня."""
+        if now is None:
+            now = time.time()
+        cutoff = int(now) - self.raw_days * DAY
+        return cutoff - cutoff % DAY
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def read(self, device_id, sensor, start_ts, end_ts):
+        return self.segments.read(device_id, sensor, start_ts, end_ts)
+
+    def run_once(self, now=None):
+        """Архивирует все дни старше границы хранения. Возвращает число перенесённых строк."""
+        cutoff = self.cutoff(now)
+        conn = storage.connect(self.db_file)
+        moved = 0
+        try:
+            while not self._stop.is_set():
+                row = conn.execute("SELECT MIN(ts) FROM sensor_data WHERE ts < ?", (cutoff,)).fetchone()
+                if row[0] is None:
+                    break
+                day_ts = row[0] - row[0] % DAY
+                moved += self._archive_day(conn, day_ts, min(day_ts + DAY, cutoff))
+        finally:
+            conn.close()
+        self.runs += 1
+        return moved
+
+    def _archive_day(self, conn, start_ts, end_ts):
+        cursor = conn.execute('''
+            SELECT rowid, device_id, sensor, ts, value FROM sensor_data
+            WHERE ts >= ? AND ts < ?
+            ORDER BY device_id, sensor, ts
+        ''', (start_ts, end_ts))
+        rows = cursor.fetchall()
+        groups = {}
+        max_rowid = 0
+        for rowid, device_id, sensor, ts, value in rows:
+            groups.setdefault((device_id, sensor), []).append((ts, value))
+            max_rowid = max(max_rowid, rowid)
+        for (device_id, sensor), values in groups.items():
+            series = np.array(values, dtype=columnar.RAW_DTYPE)
+            self.segments.write_day(device_id, sensor, start_ts, series)
+        # Удаляем только выгруженные строки: запоздавшие показания за этот день уйдут в следующий проход
+        while not self._stop.is_set():
+            with conn:
+                deleted = conn.execute('''
+                    DELETE FROM sensor_data WHERE rowid IN (
+                        SELECT rowid FROM sensor_data WHERE ts >= ? AND ts < ? AND rowid <= ? LIMIT ?
+                    )
+                ''', (start_ts, end_ts, max_rowid, self.batch_rows)).rowcount
+            if deleted < self.batch_rows:
+                break
+            time.sleep(self.pause)
+        self.archived += len(rows)
+        print(f"Архивировано {len(rows)} показаний за {day_name(start_ts)}")
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except (sqlite3.Error, OSError) as e:
+                print("Ошибка архивирования старых показаний:", e)
+                self.errors += 1
+            self._stop.wait(self.interval)
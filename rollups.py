@@ -0,0 +1,157 @@
+import math
+from collections import defaultdict
+
+import columnar
+from schema import DEFAULT_DEVICE
+
+# Разрешения агрегатов: суффикс таблицы -> ширина корзины в секундах
+ROLLUP_RESOLUTIONS = [
+    ("1m", 60),
+    ("1h", 3600),
+    ("1d", 86400),
+]
+
+# Верхняя граница числа точек на одном графике
+TARGET_POINTS = 2000
+
+
+def rollup_table(suffix):
+    return f"sensor_rollup_{suffix}"
+
+
+def create_rollup_tables(c):
+    for suffix, _ in ROLLUP_RESOLUTIONS:
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS {rollup_table(suffix)} (
+                device_id TEXT NOT NULL,
+                sensor TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                min REAL,
+                max REAL,
+                sum REAL,
+                count INTEGER,
+                PRIMARY KEY (device_id, sensor, bucket)
+            ) WITHOUT ROWID
+        ''')
+
+
+def rebuild_rollups(c, sensor=None, start_ts=None, end_ts=None, device_id=None):
+    """Пересчитывает агрегаты по сырым данным (целиком или для устройства, датчика, диапазона ts)."""
+    where = ["ts IS NOT NULL"]
+    params = []
+    if device_id is not None:
+        where.append("device_id = ?")
+        params.append(device_id)
+    if sensor is not None:
+        where.append("sensor = ?")
+        params.append(sensor)
+    if start_ts is not None:
+        where.append("ts >= ?")
+        params.append(start_ts)
+    if end_ts is not None:
+        where.append("ts <= ?")
+        params.append(end_ts)
+    for suffix, width in ROLLUP_RESOLUTIONS:
+        c.execute(f'''
+            INSERT OR REPLACE INTO {rollup_table(suffix)} (device_id, sensor, bucket, min, max, sum, count)
+            SELECT device_id, sensor, (ts / {width}) * {width}, MIN(value), MAX(value), SUM(value), COUNT(*)
+            FROM sensor_data
+            WHERE {" AND ".join(where)}
+            GROUP BY device_id, sensor, ts / {width}
+        ''', params)
+
+
+def update_rollups(conn, rows):
+    """
+    Инкрементально добавляет пачку показаний (device_id, sensor, value, ts) во все таблицы агрегатов.
+    Пачка сначала сворачивается в памяти, поэтому на каждую корзину приходится один upsert.
+    Вызывается внутри транзакции записи сырых данных.
+    """
+    for suffix, width in ROLLUP_RESOLUTIONS:
+        buckets = defaultdict(lambda: [math.inf, -math.inf, 0.0, 0])
+        for device_id, sensor, value, ts in rows:
+            acc = buckets[(device_id, sensor, ts // width * width)]
+            if value < acc[0]:
+                acc[0] = value
+            if value > acc[1]:
+                acc[1] = value
+            acc[2] += value
+            acc[3] += 1
+        conn.executemany(f'''
+            INSERT INTO {rollup_table(suffix)} (device_id, sensor, bucket, min, max, sum, count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (device_id, sensor, bucket) DO UPDATE SET
+                min = MIN(min, excluded.min),
+                max = MAX(max, excluded.max),
+                sum = sum + excluded.sum,
+                count = count + excluded.count
+        ''', [(*key, *acc) for key, acc in buckets.items()])
+
+
+def merge_raw_rows(conn, first_id, last_id):
+    """
+    Добавляет во все таблицы агрегатов строки sensor_data с id в [first_id, last_id]
+    одним запросом на таблицу. Используется после массовой загрузки вместо update_rollups
+    на каждую пачку; агрегаты других строк, в том числе ушедших в архив, сохраняются.
+    """
+    for suffix, width in ROLLUP_RESOLUTIONS:
+        conn.execute(f'''
+            INSERT INTO {rollup_table(suffix)} (device_id, sensor, bucket, min, max, sum, count)
+            SELECT device_id, sensor, (ts / {width}) * {width}, MIN(value), MAX(value), SUM(value), COUNT(*)
+            FROM sensor_data
+            WHERE id BETWEEN ? AND ? AND ts IS NOT NULL
+            GROUP BY device_id, sensor, ts / {width}
+            ON CONFLICT (device_id, sensor, bucket) DO UPDATE SET
+                min = MIN(min, excluded.min),
+                max = MAX(max, excluded.max),
+                sum = sum + excluded.sum,
+                count = count + excluded.count
+        ''', (first_id, last_id))
+
+
+def choose_resolution(span_seconds, target_points=TARGET_POINTS):
+    """
+    Подбирает самую грубую таблицу агрегатов и ширину корзины (кратную ей), при которых
+    на графике будет не больше target_points точек. Возвращает None, если достаточно
+    сырых данных.
+    """
+    desired = span_seconds / target_points
+    chosen = None
+    for suffix, width in ROLLUP_RESOLUTIONS:
+        if width <= desired:
+            chosen = (suffix, width)
+    if chosen is None:
+        return None
+    suffix, width = chosen
+    return suffix, width * math.ceil(desired / width)
+
+
+def table_for_width(bucket_width):
+    """Самая грубая таблица агрегатов, из корзин которой складывается корзина bucket_width, или None."""
+    for suffix, width in reversed(ROLLUP_RESOLUTIONS):
+        if bucket_width % width == 0:
+            return suffix
+    return None
+
+
+def sensor_case(sensors):
+    """Выражение SQL, дающее номер датчика в списке sensors (параметры — сами sensors)."""
+    return "CASE sensor " + " ".join(f"WHEN ? THEN {i}" for i in range(len(sensors))) + " END"
+
+
+def query_rollup_many(conn, sensors, start_ts, end_ts, suffix, bucket_width, device_id=DEFAULT_DEVICE):
+    """
+    Агрегаты нескольких датчиков одним запросом: список массивов columnar.ROLLUP_DTYPE
+    (ts, value=mean, min, max) с корзинами шириной bucket_width в порядке sensors.
+    Первая корзина берётся целиком, даже если start_ts попадает в её середину.
+    """
+    placeholders = ", ".join("?" * len(sensors))
+    cursor = conn.execute(f'''
+        SELECT {sensor_case(sensors)} AS k, (bucket / ?) * ? AS b, SUM(sum) / SUM(count), MIN(min), MAX(max)
+        FROM {rollup_table(suffix)}
+        WHERE device_id = ? AND sensor IN ({placeholders}) AND bucket BETWEEN ? AND ?
+        GROUP BY k, b
+        ORDER BY k, b
+    ''', (*sensors, bucket_width, bucket_width, device_id, *sensors, start_ts - start_ts % bucket_width, end_ts))
+    rows = columnar.fetch_array(cursor, columnar.keyed(columnar.ROLLUP_DTYPE))
+    return columnar.split_keyed(rows, len(sensors), columnar.ROLLUP_DTYPE)
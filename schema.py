@@ -0,0 +1,162 @@
+import sqlite3
+import datetime
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Текущая версия схемы, хранится в PRAGMA user_version
+SCHEMA_VERSION = 5
+
+# Устройство, к которому относятся показания со старых топиков без device_id
+DEFAULT_DEVICE = "default"
+
+# Индексы sensor_data в актуальной схеме (имя, колонки); backfill.py снимает их на время загрузки
+SENSOR_DATA_INDEXES = [
+    ("idx_sensor_data_device_sensor_ts", "(device_id, sensor, ts)"),
+    ("idx_sensor_data_ts", "(ts)"),
+]
+
+
+def to_epoch(value):
+    """Переводит datetime или строку вида "%Y-%m-%d %H:%M:%S" (локальное время) в секунды Unix."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.datetime.strptime(value, TIMESTAMP_FORMAT)
+    return int(value.timestamp())
+
+
+def format_timestamp(epoch):
+    return datetime.datetime.fromtimestamp(epoch).strftime(TIMESTAMP_FORMAT)
+
+
+def _migrate_v1(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sensor_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sensor TEXT,
+            value REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            chat_id INTEGER PRIMARY KEY
+        )
+    ''')
+
+
+def _migrate_v2(c):
+    """
+    Добавляет целочисленную метку времени ts (секунды Unix) и индекс (sensor, ts).
+    Текстовая колонка timestamp остаётся и продолжает заполняться, чтобы старый
+    код мог её читать. Строки, вставленные без ts (старые версии скриптов),
+    получают его через триггер.
+    """
+    columns = [row[1] for row in c.execute("PRAGMA table_info(sensor_data)")]
+    if "ts" not in columns:
+        c.execute("ALTER TABLE sensor_data ADD COLUMN ts INTEGER")
+    # Старые строки хранят локальное время, модификатор 'utc' переводит его в UTC
+    c.execute("UPDATE sensor_data SET ts = CAST(strftime('%s', timestamp, 'utc') AS INTEGER) WHERE ts IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_sensor_ts ON sensor_data (sensor, ts)")
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_sensor_data_fill_ts
+        AFTER INSERT ON sensor_data
+        WHEN NEW.ts IS NULL
+        BEGIN
+            UPDATE sensor_data
+            SET ts = CAST(strftime('%s', NEW.timestamp, 'utc') AS INTEGER)
+            WHERE id = NEW.id;
+        END
+    ''')
+
+
+def _migrate_v3(c):
+    """
+    Таблицы агрегатов 1m/1h/1d без device_id. Их схема заменена миграцией 4,
+    которая удаляет и строит агрегаты заново, поэтому здесь ничего не делается.
+    """
+
+
+def _migrate_v4(c):
+    """
+    Несколько устройств: колонка device_id у показаний (старые строки относятся к
+    DEFAULT_DEVICE), индекс (device_id, sensor, ts), таблица устройств и агрегаты
+    с разбивкой по устройствам.
+    """
+    import rollups
+    columns = [row[1] for row in c.execute("PRAGMA table_info(sensor_data)")]
+    if "device_id" not in columns:
+        c.execute(f"ALTER TABLE sensor_data ADD COLUMN device_id TEXT NOT NULL DEFAULT '{DEFAULT_DEVICE}'")
+    c.execute("DROP INDEX IF EXISTS idx_sensor_data_sensor_ts")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_device_sensor_ts ON sensor_data (device_id, sensor, ts)")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS devices (
+            device_id TEXT PRIMARY KEY,
+            first_seen INTEGER,
+            last_seen INTEGER
+        )
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO devices (device_id, first_seen, last_seen)
+        SELECT device_id, MIN(ts), MAX(ts) FROM sensor_data GROUP BY device_id
+    ''')
+    for suffix, _ in rollups.ROLLUP_RESOLUTIONS:
+        c.execute(f"DROP TABLE IF EXISTS {rollups.rollup_table(suffix)}")
+    rollups.create_rollup_tables(c)
+    rollups.rebuild_rollups(c)
+
+
+def _migrate_v5(c):
+    """Индекс по ts для выборки старых строк при архивировании (retention.py)."""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_ts ON sensor_data (ts)")
+
+
+def touch_devices(conn, rows):
+    """Регистрирует устройства из пачки (device_id, ts) и обновляет время их последнего показания."""
+    seen = {}
+    for device_id, ts in rows:
+        first, last = seen.get(device_id, (ts, ts))
+        seen[device_id] = (min(first, ts), max(last, ts))
+    conn.executemany('''
+        INSERT INTO devices (device_id, first_seen, last_seen) VALUES (?, ?, ?)
+        ON CONFLICT (device_id) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)
+    ''', [(device_id, first, last) for device_id, (first, last) in seen.items()])
+
+
+MIGRATIONS = [
+    (1, _migrate_v1),
+    (2, _migrate_v2),
+    (3, _migrate_v3),
+    (4, _migrate_v4),
+    (5, _migrate_v5),
+]
+
+
+def migrate(conn):
+    """Приводит схему БД к SCHEMA_VERSION. Каждая миграция выполняется в своей транзакции."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, step in MIGRATIONS:
+        if version >= target:
+            continue
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN")
+            step(c)
+            c.execute(f"PRAGMA user_version = {target}")
+            c.execute("COMMIT")
+        except sqlite3.Error:
+            c.execute("ROLLBACK")
+            raise
+        print(f"Схема БД обновлена до версии {target}")
+        version = target
+    return version
+
+
+def check_and_create_db(db_file):
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        # WAL сохраняется в файле БД: чтения бота не блокируют запись показаний и наоборот
+        conn.execute("PRAGMA journal_mode = WAL")
+        migrate(conn)
+    finally:
+        conn.close()
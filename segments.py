@@ -0,0 +1,127 @@
+import datetime
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import columnar
+
+DAY = 86400
+# Сегмент дня: массив columnar.RAW_DTYPE (int64 ts, float64 value) в формате .npy без сжатия
+SEGMENT_SUFFIX = ".npy"
+# Сколько отображённых в память сегментов держать открытыми
+MAX_OPEN_SEGMENTS = 256
+
+
+def day_name(day_ts):
+    return datetime.datetime.fromtimestamp(day_ts, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def segment_path(root, device_id, sensor, day_ts):
+    return os.path.join(root, device_id, sensor, f"{day_name(day_ts)}{SEGMENT_SUFFIX}")
+
+
+def slice_range(series, start_ts, end_ts):
+    """Показания упорядоченного по ts массива из [start_ts, end_ts]; для memmap — представление без копии."""
+    ts = series['ts']
+    lo = np.searchsorted(ts, start_ts, side='left')
+    hi = np.searchsorted(ts, end_ts, side='right')
+    return series[lo:hi]
+
+
+class SegmentStore:
+    """
+    Холодная история: один неизменяемый сегмент на (устройство, датчик, UTC-день),
+    root/<device_id>/<sensor>/<YYYY-MM-DD>.npy. Сегмент — упорядоченный по ts массив
+    columnar.RAW_DTYPE; при чтении он отображается в память (np.load с mmap_mode),
+    и выборка диапазона возвращает представление на отображённые страницы: читаются
+    только затронутые байты, а память процесса не растёт с длиной периода.
+
+    Сегменты пишет уплотнитель (retention.RetentionEngine) после закрытия дня;
+    запись атомарна (временный файл и os.replace), поэтому читатели видят либо
+    старую, либо новую версию дня.
+    """
+
+    def __init__(self, root, max_open=MAX_OPEN_SEGMENTS):
+        self.root = root
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _map(self, path):
+        """Отображённый в память сегмент или None, если его нет."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        # os.replace при перезаписи дня меняет inode, и старое отображение перестаёт использоваться
+        version = (stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._open.get(path)
+            if entry is not None and entry[0] == version:
+                self._open.move_to_end(path)
+                return entry[1]
+        series = np.load(path, mmap_mode='r')
+        if series.dtype != columnar.RAW_DTYPE:
+            raise ValueError(f"Неверный формат сегмента {path}: {series.dtype}")
+        with self._lock:
+            self._open[path] = (version, series)
+            self._open.move_to_end(path)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return series
+
+    def read_day(self, device_id, sensor, day_ts):
+        """Весь день: memmap сегмента или None."""
+        return self._map(segment_path(self.root, device_id, sensor, day_ts))
+
+    def read_parts(self, device_id, sensor, start_ts, end_ts):
+        """Куски диапазона [start_ts, end_ts] по дням, по возрастанию времени."""
+        if not os.path.isdir(os.path.join(self.root, device_id, sensor)):
+            return []
+        parts = []
+        day_ts = start_ts - start_ts % DAY
+        while day_ts <= end_ts:
+            series = self.read_day(device_id, sensor, day_ts)
+            if series is not None:
+                part = slice_range(series, start_ts, end_ts)
+                if len(part):
+                    parts.append(part)
+            day_ts += DAY
+        return parts
+
+    def read(self, device_id, sensor, start_ts, end_ts):
+        """
+        Показания из диапазона в виде массива RAW_DTYPE. Если диапазон укладывается
+        в один сегмент, это представление memmap без копирования; иначе затронутые
+        куски склеиваются в один массив.
+        """
+        parts = self.read_parts(device_id, sensor, start_ts, end_ts)
+        if not parts:
+            return np.empty(0, dtype=columnar.RAW_DTYPE)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def write_day(self, device_id, sensor, day_ts, series):
+        """
+        Записывает сегмент дня. Если день уже есть (запоздавшие показания), новые
+        показания сливаются с ним без повторов.
+        """
+        path = segment_path(self.root, device_id, sensor, day_ts)
+        old = self.read_day(device_id, sensor, day_ts)
+        if old is not None:
+            series = columnar.merge_series(np.asarray(old), series)
+        else:
+            series = series[np.argsort(series['ts'], kind='stable')]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(series, dtype=columnar.RAW_DTYPE))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._open.pop(path, None)
+        return len(series)
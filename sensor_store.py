@@ -0,0 +1,223 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import columnar
+import rollups
+import schema
+from schema import format_timestamp, touch_devices, DEFAULT_DEVICE
+from storage import Storage, LatencyStats, CACHE_SIZE_KIB
+
+
+class SensorStore:
+    """
+    Интерфейс хранилища показаний, через который работают бот и IngestWriter.
+
+    Показания передаются пачками (device_id, sensor, value, ts), выборки возвращаются
+    массивами NumPy: columnar.RAW_DTYPE для сырых данных и columnar.ROLLUP_DTYPE
+    для агрегатов. Методы вызываются из разных потоков.
+    """
+
+    def __init__(self):
+        self.latency = LatencyStats()
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latency.record(name, (time.perf_counter() - start) * 1000.0)
+
+    def latency_stats(self):
+        return self.latency.snapshot()
+
+    def prepare(self):
+        """Создаёт или обновляет структуру хранилища; вызывается один раз при старте."""
+
+    def append(self, rows):
+        raise NotImplementedError
+
+    def latest(self, sensor, device_id=DEFAULT_DEVICE):
+        """Последнее показание: (value, timestamp) или None."""
+        raise NotImplementedError
+
+    def range(self, sensor, start_ts, end_ts, device_id=DEFAULT_DEVICE):
+        """Показания с ts в [start_ts, end_ts] по возрастанию времени."""
+        raise NotImplementedError
+
+    def range_many(self, sensors, start_ts, end_ts, device_id=DEFAULT_DEVICE):
+        """range для нескольких датчиков; словарь датчик -> массив."""
+        return {sensor: self.range(sensor, start_ts, end_ts, device_id) for sensor in sensors}
+
+    def tail(self, sensor, n, device_id=DEFAULT_DEVICE):
+        """До n последних показаний по возрастанию времени."""
+        raise NotImplementedError
+
+    def aggregate(self, sensor, start_ts, end_ts, bucket_width, device_id=DEFAULT_DEVICE):
+        """Среднее, минимум и максимум по корзинам шириной bucket_width секунд."""
+        raise NotImplementedError
+
+    def aggregate_many(self, sensors, start_ts, end_ts, bucket_width, device_id=DEFAULT_DEVICE):
+        """aggregate для нескольких датчиков; словарь датчик -> массив."""
+        return {sensor: self.aggregate(sensor, start_ts, end_ts, bucket_width, device_id) for sensor in sensors}
+
+    def devices(self):
+        """Устройства, начиная с последнего приславшего показания."""
+        raise NotImplementedError
+
+    def add_user(self, chat_id):
+        raise NotImplementedError
+
+    def users(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SqliteSensorStore(SensorStore):
+    """
+    Хранилище в SQLite (схема из schema.py). Запись показаний и пользователей идёт
+    через одно соединение Storage.writer, чтения — через пул соединений только для чтения.
+    Агрегаты берутся из таблиц rollups.py, которые обновляются в той же транзакции,
+    что и сырые данные. Если задан retention, выборки подмешивают архив.
+    """
+
+    def __init__(self, db_file, read_pool_size=4, cache_size_kib=CACHE_SIZE_KIB, retention=None):
+        super().__init__()
+        self.db_file = db_file
+        self.db = Storage(db_file, read_pool_size=read_pool_size, cache_size_kib=cache_size_kib)
+        self.db.latency = self.latency
+        self.retention = retention
+
+    def prepare(self):
+        schema.check_and_create_db(self.db_file)
+
+    def append(self, rows):
+        with self.db.writer("append") as conn:
+            conn.executemany(
+                "INSERT INTO sensor_data (device_id, sensor, value, timestamp, ts) VALUES (?, ?, ?, ?, ?)",
+                [(device_id, sensor, value, format_timestamp(ts), ts) for device_id, sensor, value, ts in rows]
+            )
+            rollups.update_rollups(conn, rows)
+            touch_devices(conn, [(row[0], row[3]) for row in rows])
+
+    def latest(self, sensor, device_id=DEFAULT_DEVICE):
+        with self.db.reader("latest") as conn:
+            return conn.execute(
+                "SELECT value, timestamp FROM sensor_data WHERE device_id=? AND sensor=? ORDER BY ts DESC LIMIT 1",
+                (device_id, sensor)
+            ).fetchone()
+
+    def range(self, sensor, start_ts, end_ts, device_id=DEFAULT_DEVICE):
+        return self.range_many([sensor], start_ts, end_ts, device_id)[sensor]
+
+    def range_many(self, sensors, start_ts, end_ts, device_id=DEFAULT_DEVICE):
+        sensors = list(sensors)
+        placeholders = ", ".join("?" * len(sensors))
+        with self.db.reader("range") as conn:
+            cursor = conn.execute(f'''
+                SELECT {rollups.sensor_case(sensors)} AS k, ts, value FROM sensor_data
+                WHERE device_id=? AND sensor IN ({placeholders}) AND ts BETWEEN ? AND ?
+                ORDER BY k, ts
+            ''', (*sensors, device_id, *sensors, start_ts, end_ts))
+            rows = columnar.fetch_array(cursor, columnar.keyed(columnar.RAW_DTYPE))
+        result = dict(zip(sensors, columnar.split_keyed(rows, len(sensors), columnar.RAW_DTYPE)))
+        if self.retention is not None and start_ts < self.retention.cutoff():
+            # Начало периода уже могло уйти в архив
+            for sensor in sensors:
+                archived = self.retention.read(device_id, sensor, start_ts, end_ts)
+                if not len(result[sensor]):
+                    # Период целиком в архиве: отдаём представление сегмента без копирования
+                    result[sensor] = archived
+                elif len(archived):
+                    result[sensor] = columnar.merge_series(archived, result[sensor])
+        return result
+
+    def tail(self, sensor, n, device_id=DEFAULT_DEVICE):
+        with self.db.reader("tail") as conn:
+            cursor = conn.execute(
+                "SELECT ts, value FROM sensor_data WHERE device_id=? AND sensor=? "
+                "ORDER BY ts DESC, id DESC LIMIT ?",
+                (device_id, sensor, n)
+            )
+            return columnar.fetch_array(cursor)[::-1]
+
+    def aggregate(self, sensor, start_ts, end_ts, bucket_width, device_id=DEFAULT_DEVICE):
+        return self.aggregate_many([sensor], start_ts, end_ts, bucket_width, device_id)[sensor]
+
+    def aggregate_many(self, sensors, start_ts, end_ts, bucket_width, device_id=DEFAULT_DEVICE):
+        sensors = list(sensors)
+        suffix = rollups.table_for_width(bucket_width)
+        if suffix is None:
+            return {
+                sensor: columnar.aggregate(series, bucket_width)
+                for sensor, series in self.range_many(sensors, start_ts, end_ts, device_id).items()
+            }
+        with self.db.reader("aggregate") as conn:
+            parts = rollups.query_rollup_many(conn, sensors, start_ts, end_ts, suffix, bucket_width, device_id)
+        return dict(zip(sensors, parts))
+
+    def devices(self):
+        with self.db.reader("devices") as conn:
+            rows = conn.execute("SELECT device_id FROM devices ORDER BY last_seen DESC").fetchall()
+        return [row[0] for row in rows]
+
+    def add_user(self, chat_id):
+        with self.db.writer("add_user") as conn:
+            conn.execute("INSERT OR IGNORE INTO users (chat_id) VALUES (?)", (chat_id,))
+
+    def users(self):
+        with self.db.reader("users") as conn:
+            rows = conn.execute("SELECT chat_id FROM users").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.db.close()
+
+
+
+class AsyncSensorStore:
+    """
+    Неблокирующий доступ к SensorStore из цикла событий бота. Вызовы выполняются
+    в отдельном пуле потоков БД (по умолчанию по размеру пула чтения SQLite),
+    обработчик ждёт результат через await, а остальные чаты тем временем обслуживаются.
+    """
+
+    def __init__(self, store, max_workers=4):
+        self.store = store
+        self.max_workers = max_workers
+        self._executor = None
+
+    def _call(self, method, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+        return asyncio.get_running_loop().run_in_executor(self._executor, method, *args)
+
+    async def latest(self, sensor, device_id=DEFAULT_DEVICE):
+        return await self._call(self.store.latest, sensor, device_id)
+
+    async def range(self, sensor, start_ts, end_ts, device_id=DEFAULT_DEVICE):
+        return await self._call(self.store.range, sensor, start_ts, end_ts, device_id)
+
+    async def range_many(self, sensors, start_ts, end_ts, device_id=DEFAULT_DEVICE):
+        return await self._call(self.store.range_many, sensors, start_ts, end_ts, device_id)
+
+    async def aggregate_many(self, sensors, start_ts, end_ts, bucket_width, device_id=DEFAULT_DEVICE):
+        return await self._call(self.store.aggregate_many, sensors, start_ts, end_ts, bucket_width, device_id)
+
+    async def devices(self):
+        return await self._call(self.store.devices)
+
+    async def add_user(self, chat_id):
+        return await self._call(self.store.add_user, chat_id)
+
+    async def users(self):
+        return await self._call(self.store.users)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
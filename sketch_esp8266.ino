@@ -30,7 +30,20 @@ const int mqtt_port = 1883;
 
 WiFiClient espClient;
 PubSubClient client(espClient);
-String clientId = "ESP-" + String(random(0xffff), HEX);
+// Уникальный идентификатор устройства: по нему сервер разделяет данные нескольких ESP
+String deviceId = "esp-" + String(ESP.getChipId(), HEX);
+String batchTopic = "sensors/" + deviceId + "/batch";
+
+// Пакет со всеми показаниями за один замер, формат совпадает с payload.py на сервере
+struct __attribute__((packed)) BatchPayload {
+  uint8_t version;     // версия формата, 1
+  uint32_t seq;        // порядковый номер, с 0 после перезагрузки
+  uint32_t uptime;     // время работы платы, с
+  float tempC;
+  float humidity;
+  float q;
+};
+uint32_t seq = 0;
 
 void setup(void) {
   Serial.begin(115200);
@@ -54,7 +67,7 @@ void setup(void) {
 
 void reconnect() {
   while (!client.connected()) {
-    if (client.connect("arduinoClient")) {
+    if (client.connect(deviceId.c_str())) {
       Serial.println("MQTT connected");
     } else {
       Serial.print("failed, rc=");
@@ -103,10 +116,9 @@ void loop(void) {
   
   Serial.print("ADC0: "); Serial.println(adc0);  // Вывод значений на последовательный порт
   Serial.print("ADC1: "); Serial.println(adc1);
-  // Отправка данных
-  client.publish("sensors/temperature", String(tempC).c_str());
-  client.publish("sensors/humidity", String(Humidity).c_str());
-  client.publish("sensors/thermal", String(q).c_str());
+  // Отправка данных одним сообщением
+  BatchPayload batch = {1, seq++, millis() / 1000, tempC, Humidity, q};
+  client.publish(batchTopic.c_str(), (const uint8_t*)&batch, sizeof(batch));
 
    delay(59000);
 
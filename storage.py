@@ -0,0 +1,139 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Размер страничного кэша каждого соединения, КиБ
+CACHE_SIZE_KIB = 16384
+# Сколько ждать освобождения блокировки вместо немедленного "database is locked", мс
+BUSY_TIMEOUT_MS = 5000
+
+
+def connect(db_file, readonly=False, check_same_thread=True,
+            cache_size_kib=CACHE_SIZE_KIB, busy_timeout_ms=BUSY_TIMEOUT_MS):
+    """
+    Открывает соединение с настройками для совместной работы чтения и записи.
+    Режим WAL включается один раз в schema.check_and_create_db и хранится в файле БД;
+    synchronous=NORMAL в WAL не теряет целостность, а fsync выполняется только на checkpoint.
+    """
+    if readonly:
+        conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(db_file, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{int(cache_size_kib)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+class LatencyStats:
+    """
+    Число вызовов, суммарное, максимальное и последнее время выполнения по именам операций.
+    Каждый замер также попадает в гистограмму metrics.DB_SECONDS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, elapsed_ms):
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                stat = self._stats[name] = [0, 0.0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += elapsed_ms
+            stat[2] = max(stat[2], elapsed_ms)
+            stat[3] = elapsed_ms
+        metrics.DB_SECONDS.observe(elapsed_ms / 1000.0, op=name)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    "calls": count,
+                    "avg_ms": total / count,
+                    "max_ms": max_ms,
+                    "last_ms": last_ms,
+                }
+                for name, (count, total, max_ms, last_ms) in self._stats.items()
+            }
+
+
+class Storage:
+    """
+    Соединения с БД для sensor_store.SqliteSensorStore.
+
+    Чтения идут через пул из read_pool_size соединений только для чтения: в режиме WAL
+    они не ждут запись и не мешают ей. Все записи — пачки показаний от IngestWriter
+    (SqliteSensorStore.append) и таблица users — выполняются через единственное
+    соединение writer под блокировкой. Время каждой операции учитывается в latency
+    по её имени.
+    """
+
+    def __init__(self, db_file, read_pool_size=4, cache_size_kib=CACHE_SIZE_KIB):
+        self.db_file = db_file
+        self.read_pool_size = read_pool_size
+        self.cache_size_kib = cache_size_kib
+        self.latency = LatencyStats()
+        self._readers = queue.Queue()
+        self._opened = 0
+        self._open_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.Lock()
+
+    def _take_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._open_lock:
+            if self._opened < self.read_pool_size:
+                self._opened += 1
+                return connect(self.db_file, readonly=True, check_same_thread=False,
+                               cache_size_kib=self.cache_size_kib)
+        return self._readers.get()
+
+    @contextmanager
+    def reader(self, name):
+        conn = self._take_reader()
+        start = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            self.latency.record(name, (time.perf_counter() - start) * 1000.0)
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self, name):
+        """Соединение для записи внутри транзакции; записи выполняются по очереди."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = connect(self.db_file, check_same_thread=False,
+                                       cache_size_kib=self.cache_size_kib)
+            start = time.perf_counter()
+            try:
+                with self._writer:
+                    yield self._writer
+            finally:
+                self.latency.record(name, (time.perf_counter() - start) * 1000.0)
+
+    def latency_stats(self):
+        return self.latency.snapshot()
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._open_lock:
+            self._opened = 0
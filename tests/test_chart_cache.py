@@ -0,0 +1,138 @@
+"""ChartCache: одно построение на ключ для одновременных запросов, вытеснение и некэшируемые результаты."""
+import asyncio
+
+import pytest
+
+from chart_cache import ChartCache, ChartEntry, DataVersions
+
+
+class Renderer:
+    """Счётчик построений; каждое ждёт события release, чтобы запросы успели встретиться."""
+
+    def __init__(self, result=b"png", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return ChartEntry(self.result) if self.result is not None else None
+
+
+async def gather_callers(cache, key, renderer, callers=10):
+    tasks = [asyncio.create_task(cache.get_or_render(key, renderer)) for _ in range(callers)]
+    await asyncio.sleep(0)
+    renderer.release.set()
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_concurrent_callers_share_one_render():
+    async def scenario():
+        cache = ChartCache()
+        renderer = Renderer()
+        results = await gather_callers(cache, "k", renderer)
+        again = await cache.get_or_render("k", renderer)
+        return cache, renderer, results, again
+
+    cache, renderer, results, again = asyncio.run(scenario())
+    assert renderer.calls == 1
+    assert all(result is results[0] for result in results)
+    assert again is results[0]
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] == 9 and stats["hits"] == 1
+    assert not cache._inflight
+
+
+def test_error_reaches_every_waiter_and_is_not_cached():
+    async def scenario():
+        cache = ChartCache()
+        failing = Renderer(error=RuntimeError("render failed"))
+        results = await gather_callers(cache, "k", failing)
+        inflight = dict(cache._inflight)
+        # Следующий запрос строит график заново
+        retry = Renderer()
+        retry.release.set()
+        entry = await cache.get_or_render("k", retry)
+        return cache, failing, results, inflight, retry, entry
+
+    cache, failing, results, inflight, retry, entry = asyncio.run(scenario())
+    assert failing.calls == 1
+    assert len(results) == 10
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert inflight == {}
+    assert retry.calls == 1 and entry.png == b"png"
+    assert cache.stats()["entries"] == 1
+
+
+def test_none_is_not_cached():
+    async def scenario():
+        cache = ChartCache()
+        empty = Renderer(result=None)
+        results = await gather_callers(cache, "k", empty, callers=3)
+        second = Renderer(result=None)
+        second.release.set()
+        await cache.get_or_render("k", second)
+        return cache, empty, second, results
+
+    cache, empty, second, results = asyncio.run(scenario())
+    assert results == [None, None, None]
+    assert empty.calls == 1 and second.calls == 1
+    assert cache.stats()["entries"] == 0
+    assert not cache._inflight
+
+
+def render_now(png):
+    async def render():
+        return ChartEntry(png)
+    return render
+
+
+def test_eviction_by_bytes_and_entries():
+    async def scenario():
+        cache = ChartCache(max_entries=3, max_bytes=250)
+        for key in "abc":
+            await cache.get_or_render(key, render_now(b"x" * 100))
+        return cache
+
+    cache = asyncio.run(scenario())
+    # Три графика по 100 байт не помещаются в 250: вытеснен самый старый
+    assert list(cache._entries) == ["b", "c"]
+    assert cache.size_bytes == 200
+    assert cache.stats()["evictions"] == 1
+
+    async def touch_and_add():
+        await cache.get_or_render("b", render_now(b""))
+        await cache.get_or_render("d", render_now(b"y" * 10))
+        await cache.get_or_render("e", render_now(b"z" * 10))
+
+    asyncio.run(touch_and_add())
+    # Недавно запрошенный "b" остаётся, по числу записей вытесняется "c"
+    assert list(cache._entries) == ["b", "d", "e"]
+    assert cache.size_bytes == 120
+
+
+def test_cancelled_render_clears_inflight():
+    async def scenario():
+        cache = ChartCache()
+        renderer = Renderer()
+        task = asyncio.create_task(cache.get_or_render("k", renderer))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return cache
+
+    assert not asyncio.run(scenario())._inflight
+
+
+def test_data_versions():
+    versions = DataVersions()
+    versions.bump([("dev", "tempC", 1.0, 10), ("dev", "tempC", 2.0, 20), ("dev", "q", 3.0, 20)])
+    versions.bump([("dev", "q", 4.0, 30)])
+    assert versions.get("dev", "tempC") == 1
+    assert versions.get("dev", "q") == 2
+    assert versions.get("other", "q") == 0
@@ -0,0 +1,87 @@
+"""Прореживание рядов для графиков: columnar.m4 и columnar.thin_rollups."""
+import numpy as np
+import pytest
+
+import columnar
+
+
+def raw_series(n, step=10, seed=0, start_ts=1_700_000_000):
+    rng = np.random.default_rng(seed)
+    series = np.empty(n, dtype=columnar.RAW_DTYPE)
+    series['ts'] = start_ts + np.arange(n, dtype='<i8') * step
+    series['value'] = 20.0 + np.cumsum(rng.normal(0.0, 0.05, n))
+    return series
+
+
+@pytest.mark.parametrize("max_points", [4, 10, 2000])
+@pytest.mark.parametrize("n", [5, 2001, 100_000])
+def test_m4_stays_within_max_points(n, max_points):
+    series = raw_series(n)
+    result = columnar.m4(series, max_points)
+    assert len(result) <= max_points
+    assert np.all(np.diff(result['ts']) > 0)
+
+
+def test_m4_keeps_single_sample_spike_and_last_point():
+    series = raw_series(100_000)
+    series['value'][12_345] = 500.0
+    series['value'][67_890] = -500.0
+    result = columnar.m4(series, 2000)
+    assert 500.0 in result['value'] and -500.0 in result['value']
+    assert result[0] == series[0]
+    assert result[-1] == series[-1]
+
+
+def test_m4_short_series_is_unchanged():
+    series = raw_series(100)
+    assert columnar.m4(series, 2000) is series
+
+
+def test_m4_ignores_nan_when_finding_extremes():
+    series = raw_series(10_000)
+    series['value'][::97] = np.nan
+    series['value'][5_001] = 99.0
+    result = columnar.m4(series, 40)
+    assert len(result) <= 40
+    assert 99.0 in result['value']
+    assert np.nanmin(result['value']) == np.nanmin(series['value'])
+
+
+def test_m4_equal_timestamps():
+    series = raw_series(1000)
+    series['ts'] = series['ts'][0]
+    series['value'][500] = 77.0
+    result = columnar.m4(series, 8)
+    assert 1 <= len(result) <= 4
+    assert 77.0 in result['value']
+    assert result[-1] == series[-1]
+
+
+def test_m4_repeated_timestamps_within_buckets():
+    series = raw_series(10_000)
+    series['ts'] = series['ts'][0] + np.arange(10_000) // 10
+    series['value'][4_444] = -99.0
+    result = columnar.m4(series, 100)
+    assert len(result) <= 100
+    assert -99.0 in result['value']
+
+
+def test_thin_rollups_keeps_band():
+    rollup = columnar.aggregate(raw_series(500_000), 60)
+    rollup['max'][1234] = 300.0
+    rollup['min'][4321] = -300.0
+    result = columnar.thin_rollups(rollup, 2000)
+    assert len(result) <= 2000
+    assert result['max'].max() == 300.0
+    assert result['min'].min() == -300.0
+    assert result['ts'][0] == rollup['ts'][0]
+    assert np.all(np.diff(result['ts']) > 0)
+    assert result['value'].mean() == pytest.approx(rollup['value'].mean(), rel=1e-3)
+
+
+def test_downsample_dispatches_by_dtype():
+    series = raw_series(10_000)
+    rollup = columnar.aggregate(series, 60)
+    assert columnar.downsample(series, 400).dtype == columnar.RAW_DTYPE
+    assert columnar.downsample(rollup, 400).dtype == columnar.ROLLUP_DTYPE
+    assert len(columnar.downsample(rollup, 400)) <= 400
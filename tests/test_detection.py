@@ -0,0 +1,94 @@
+"""StreamingDetector: перепады до attach() не теряются, подавление повторов начинается с отправленного алерта."""
+import asyncio
+
+from detection import AlertEvent, StreamingDetector
+
+
+def feed_spike(detector, start_ts, base=20.0):
+    """Ровный ряд и резкий скачок в конце; возвращает результат observe для скачка."""
+    for i in range(10):
+        detector.observe("tempC", base + 0.01 * (i % 2), start_ts + i * 10)
+    return detector.observe("tempC", base + 10.0, start_ts + 100)
+
+
+def test_spike_before_attach_is_delivered():
+    detector = StreamingDetector({"tempC": 2.0}, cooldown=300)
+    assert feed_spike(detector, 1000) is not None
+
+    async def receive():
+        detector.attach(asyncio.get_running_loop())
+        return await asyncio.wait_for(detector.queue.get(), 1.0)
+
+    event = asyncio.run(receive())
+    assert event.sensor == "tempC" and event.ts == 1100
+    assert detector.dropped == 0
+
+
+def test_cooldown_starts_on_confirm():
+    detector = StreamingDetector({"tempC": 2.0}, cooldown=300)
+
+    async def scenario():
+        detector.attach(asyncio.get_running_loop())
+        first = feed_spike(detector, 1000)
+        # Перепад не подтверждён (алерт не отправлен) — следующий не подавляется
+        second = detector.observe("tempC", 50.0, 1150)
+        detector.confirm(second)
+        # После отправленного алерта повтор в пределах cooldown подавляется
+        repeat = detector.observe("tempC", 90.0, 1200)
+        await asyncio.sleep(0)
+        return first, second, repeat, detector.queue.qsize()
+
+    first, second, repeat, queued = asyncio.run(scenario())
+    assert first is not None and second is not None
+    assert repeat is None
+    assert queued == 2
+    # Перепады из очереди в пределах cooldown после отправленного потребитель отбрасывает сам
+    assert not detector.ready(AlertEvent("tempC", 1.0, 1.0, 1200, 0.0))
+    assert detector.ready(AlertEvent("tempC", 1.0, 1.0, 1450, 0.0))
+
+
+class FakeApplication:
+    bot = None
+
+
+def test_rejected_external_alert_does_not_suppress_next(monkeypatch):
+    import app
+
+    detector = StreamingDetector({"q": 3.0}, cooldown=300)
+    weather = iter([None, -30.0])
+    sent = []
+
+    async def fake_weather():
+        return next(weather)
+
+    async def fake_send_alert(bot, message, sensors, device_id):
+        sent.append((sensors, message))
+
+    monkeypatch.setattr(app, "DETECTOR", detector)
+    monkeypatch.setattr(app, "get_weather_novosibirsk", fake_weather)
+    monkeypatch.setattr(app, "send_alert", fake_send_alert)
+
+    async def scenario():
+        detector.attach(asyncio.get_running_loop())
+        consumer = asyncio.create_task(app.alert_consumer(FakeApplication()))
+        for i in range(10):
+            detector.observe("q", -5.0 + 0.01 * (i % 2), 1000 + i * 10)
+        # Погода неизвестна — алерт не отправляется
+        assert detector.observe("q", 10.0, 1100) is not None
+        await asyncio.sleep(0.05)
+        # Новый перепад через 60 с в пределах cooldown всё равно доходит до пользователей
+        assert detector.observe("q", 40.0, 1160) is not None
+        await asyncio.sleep(0.05)
+        consumer.cancel()
+
+    asyncio.run(scenario())
+    assert len(sent) == 1
+    assert sent[0][0] == ["q"]
+    assert not detector.ready(AlertEvent("q", 0.0, 0.0, 1200, 0.0))
+
+
+def test_pending_buffer_is_bounded():
+    detector = StreamingDetector({"tempC": 2.0}, cooldown=0, max_queue=1)
+    feed_spike(detector, 1000)
+    assert feed_spike(detector, 2000, base=60.0) is None
+    assert detector.dropped == 1
@@ -0,0 +1,56 @@
+"""IngestWriter: поток записи переживает ошибки хранилища."""
+import sqlite3
+import time
+
+from ingest import IngestWriter
+
+
+class FlakyStore:
+    """Хранилище, которое бросает исключения из errors по одному на вызов append, затем пишет."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.rows = []
+
+    def append(self, rows):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.rows.extend(rows)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("условие не выполнилось")
+        time.sleep(0.01)
+
+
+def test_unexpected_error_does_not_stop_writer(capsys):
+    store = FlakyStore([ValueError("плохая строка")])
+    writer = IngestWriter(store, batch_size=1, flush_interval_ms=10)
+    writer.start()
+    try:
+        writer.put("tempC", 1.0, ts=100)
+        wait_for(lambda: writer.write_errors == 1)
+        writer.put("tempC", 2.0, ts=110)
+        wait_for(lambda: writer.written == 1)
+    finally:
+        writer.stop()
+    assert store.rows == [("default", "tempC", 2.0, 110)]
+    assert writer.stats()["dropped"] == 1
+    assert "ValueError" in capsys.readouterr().err
+
+
+def test_storage_error_is_retried():
+    store = FlakyStore([sqlite3.OperationalError("database is locked")])
+    writer = IngestWriter(store, batch_size=1, flush_interval_ms=10)
+    writer.start()
+    try:
+        writer.put("tempC", 1.0, ts=100)
+        wait_for(lambda: writer.written == 1)
+    finally:
+        writer.stop()
+    assert store.rows == [("default", "tempC", 1.0, 100)]
+    assert writer.write_errors == 1
+    assert writer.dropped == 0
@@ -0,0 +1,100 @@
+"""Пакетный формат ESP8266 (payload.py) и разбор топиков MQTT (topics.py)."""
+import math
+import struct
+
+import pytest
+
+from payload import (
+    PAYLOAD_SENSORS, PAYLOAD_STRUCT, PAYLOAD_VERSION, SequenceTracker, decode_batch, encode_batch
+)
+from topics import BATCH, TopicRouter
+
+METRICS = {"temperature": "tempC", "humidity": "Humidity", "thermal": "q"}
+LEGACY_TOPICS = {"tempC": "sensors/temperature", "Humidity": "sensors/humidity", "q": "sensors/thermal"}
+
+
+def test_round_trip():
+    batch = decode_batch(encode_batch(7, 3600, {"tempC": 21.5, "Humidity": 40.25, "q": -3.0}))
+    assert batch.seq == 7
+    assert batch.uptime == 3600
+    assert batch.readings == [("tempC", 21.5), ("Humidity", 40.25), ("q", -3.0)]
+
+
+def test_unread_sensors_are_skipped():
+    data = PAYLOAD_STRUCT.pack(PAYLOAD_VERSION, 1, 10, math.nan, 55.0, math.inf)
+    assert decode_batch(data).readings == [("Humidity", 55.0)]
+    # Датчики, которых нет в словаре, кодируются как NaN
+    assert decode_batch(encode_batch(1, 10, {"q": 1.0})).readings == [("q", 1.0)]
+
+
+@pytest.mark.parametrize("size", [0, PAYLOAD_STRUCT.size - 1, PAYLOAD_STRUCT.size + 1])
+def test_wrong_length(size):
+    with pytest.raises(ValueError, match="длина"):
+        decode_batch(b"\x01" * size)
+
+
+def test_unknown_version():
+    data = struct.pack("<BII" + "f" * len(PAYLOAD_SENSORS), PAYLOAD_VERSION + 1, 1, 1, 1.0, 2.0, 3.0)
+    with pytest.raises(ValueError, match="версия"):
+        decode_batch(data)
+
+
+def test_sequence_duplicates_and_gaps():
+    tracker = SequenceTracker()
+    assert tracker.check("a", 0, 10)
+    assert tracker.check("a", 1, 20)
+    assert not tracker.check("a", 1, 20)
+    assert not tracker.check("a", 0, 25)
+    assert tracker.check("a", 5, 60)
+    # Номера разных устройств независимы
+    assert tracker.check("b", 0, 5)
+    assert tracker.stats() == {"accepted": 4, "duplicates": 2, "gaps": 3, "restarts": 0}
+
+
+def test_sequence_restart():
+    tracker = SequenceTracker()
+    assert tracker.check("a", 40, 4000)
+    # Плата перезагрузилась: время работы уменьшилось, номера начались с нуля
+    assert tracker.check("a", 0, 3)
+    assert tracker.check("a", 1, 13)
+    assert not tracker.check("a", 1, 13)
+    assert tracker.stats() == {"accepted": 3, "duplicates": 1, "gaps": 0, "restarts": 1}
+
+
+def make_router(max_routes=100000):
+    return TopicRouter(METRICS, LEGACY_TOPICS, "default", max_routes=max_routes)
+
+
+def test_legacy_topics_go_to_default_device():
+    router = make_router()
+    assert router.resolve("sensors/temperature") == ("default", "tempC")
+    assert router.resolve("sensors/thermal") == ("default", "q")
+
+
+def test_device_topics():
+    router = make_router()
+    assert router.resolve("sensors/esp-01/humidity") == ("esp-01", "Humidity")
+    assert router.resolve("sensors/esp_02/batch") == ("esp_02", BATCH)
+
+
+@pytest.mark.parametrize("topic", [
+    "sensors/esp-01/unknown",
+    "sensors/esp 01/temperature",
+    "sensors/" + "x" * 49 + "/temperature",
+    "other/esp-01/temperature",
+    "sensors/esp-01/temperature/extra",
+    "sensors/pressure",
+])
+def test_unknown_topics(topic):
+    assert make_router().resolve(topic) is None
+
+
+def test_subscriptions():
+    assert sorted(make_router().subscriptions()) == sorted(list(LEGACY_TOPICS.values()) + ["sensors/+/+"])
+
+
+def test_route_cache_is_bounded():
+    router = make_router(max_routes=len(LEGACY_TOPICS) + 2)
+    for i in range(10):
+        assert router.resolve(f"sensors/dev{i}/temperature") == (f"dev{i}", "tempC")
+    assert len(router._routes) == len(LEGACY_TOPICS) + 2
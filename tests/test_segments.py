@@ -0,0 +1,86 @@
+"""SegmentStore и RetentionEngine: сегменты дней, чтение через memmap и перенос из SQLite."""
+import sqlite3
+import time
+
+import numpy as np
+
+import columnar
+from retention import RetentionEngine
+from segments import DAY, SegmentStore
+from sensor_store import SqliteSensorStore
+
+DAY0 = 1_700_000_000 - 1_700_000_000 % DAY
+
+
+def raw(pairs):
+    return np.array(pairs, dtype=columnar.RAW_DTYPE)
+
+
+def test_write_day_merges_late_rows(tmp_path):
+    segments = SegmentStore(str(tmp_path))
+    segments.write_day("dev", "tempC", DAY0, raw([(DAY0 + 20, 2.0), (DAY0, 0.0), (DAY0 + 10, 1.0)]))
+    # Запоздавшие показания: одно с уже записанной меткой времени, остальные новые и не по порядку
+    count = segments.write_day("dev", "tempC", DAY0, raw([(DAY0 + 30, 3.0), (DAY0 + 10, 1.5), (DAY0 + 5, 0.5)]))
+    day = segments.read_day("dev", "tempC", DAY0)
+    assert count == 5
+    assert list(day['ts']) == [DAY0, DAY0 + 5, DAY0 + 10, DAY0 + 20, DAY0 + 30]
+    assert list(day['value']) == [0.0, 0.5, 1.5, 2.0, 3.0]
+    assert (tmp_path / "dev" / "tempC" / "2023-11-14.npy").exists()
+    assert not list(tmp_path.rglob("*.tmp"))
+
+
+def test_read_within_day_is_memmap_view(tmp_path):
+    segments = SegmentStore(str(tmp_path))
+    segments.write_day("dev", "tempC", DAY0, raw([(DAY0 + i * 60, float(i)) for i in range(100)]))
+    part = segments.read("dev", "tempC", DAY0 + 600, DAY0 + 1200)
+    assert isinstance(part, np.memmap)
+    assert list(part['ts']) == [DAY0 + i * 60 for i in range(10, 21)]
+    # Повторное чтение берёт уже отображённый сегмент
+    assert segments.read_day("dev", "tempC", DAY0) is segments.read_day("dev", "tempC", DAY0)
+
+
+def test_read_across_days(tmp_path):
+    segments = SegmentStore(str(tmp_path))
+    for day in range(3):
+        start = DAY0 + day * DAY
+        segments.write_day("dev", "tempC", start, raw([(start + i * 3600, day * 100.0 + i) for i in range(24)]))
+    series = segments.read("dev", "tempC", DAY0 + 22 * 3600, DAY0 + 2 * DAY + 3600)
+    assert list(series['ts']) == [DAY0 + h * 3600 for h in range(22, 24 + 24 + 2)]
+    assert series['value'][0] == 22.0 and series['value'][2] == 100.0 and series['value'][-1] == 201.0
+    assert len(segments.read("dev", "tempC", DAY0 + 3 * DAY, DAY0 + 4 * DAY)) == 0
+    assert len(segments.read("other", "tempC", DAY0, DAY0 + DAY)) == 0
+
+
+def test_rewritten_day_is_remapped(tmp_path):
+    segments = SegmentStore(str(tmp_path))
+    segments.write_day("dev", "tempC", DAY0, raw([(DAY0, 1.0)]))
+    assert len(segments.read_day("dev", "tempC", DAY0)) == 1
+    segments.write_day("dev", "tempC", DAY0, raw([(DAY0 + 60, 2.0)]))
+    assert list(segments.read_day("dev", "tempC", DAY0)['value']) == [1.0, 2.0]
+
+
+def test_retention_round_trip(tmp_path):
+    db_file = str(tmp_path / "sensor_data.db")
+    retention = RetentionEngine(db_file, str(tmp_path / "archive"), raw_days=30, pause=0)
+    store = SqliteSensorStore(db_file, read_pool_size=2, retention=retention)
+    store.prepare()
+    now = int(time.time())
+    start_ts = now - 35 * DAY
+    rows = [("dev", "tempC", float(i), start_ts + i * 900) for i in range(10 * 96)]
+    store.append(rows)
+    before = store.range("tempC", start_ts, now, "dev").copy()
+
+    moved = retention.run_once(now)
+    cutoff = retention.cutoff(now)
+    assert moved == sum(1 for row in rows if row[3] < cutoff) > 0
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT COUNT(*) FROM sensor_data WHERE ts < ?", (cutoff,)).fetchone()[0] == 0
+    conn.close()
+
+    after = store.range("tempC", start_ts, now, "dev")
+    assert np.array_equal(after['ts'], before['ts'])
+    assert np.array_equal(after['value'], before['value'])
+    # Период целиком в архиве отдаётся представлением сегмента
+    archived = store.range("tempC", start_ts, start_ts + 3600, "dev")
+    assert isinstance(archived, np.memmap) and len(archived) == 5
+    store.close()
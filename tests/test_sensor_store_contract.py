@@ -0,0 +1,141 @@
+"""Общий контракт SensorStore: оба хранилища на одних и тех же данных дают одинаковые ответы."""
+import random
+
+import numpy as np
+import pytest
+
+import columnar
+import file_store
+from file_store import ColumnarFileStore
+from schema import DEFAULT_DEVICE, format_timestamp
+from sensor_store import SqliteSensorStore
+
+# Начало дня UTC: корзины агрегатов обоих хранилищ начинаются с одних и тех же меток
+T0 = 1_699_920_000
+DEVICES = ["a", "b"]
+SENSORS = ["tempC", "humidity"]
+
+
+def make_rows(n=3000, step=20, seed=1):
+    rnd = random.Random(seed)
+    return [
+        (rnd.choice(DEVICES), rnd.choice(SENSORS), round(rnd.uniform(-5.0, 30.0), 3), T0 + i * step)
+        for i in range(n)
+    ]
+
+
+def expected(rows, device_id, sensor, start_ts=0, end_ts=2 ** 40):
+    series = np.array(
+        [(ts, value) for d, s, value, ts in rows if d == device_id and s == sensor and start_ts <= ts <= end_ts],
+        dtype=columnar.RAW_DTYPE
+    )
+    return series[np.argsort(series['ts'], kind='stable')]
+
+
+@pytest.fixture(params=["sqlite", "columnar"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        store = SqliteSensorStore(str(tmp_path / "sensor_data.db"), read_pool_size=2)
+    else:
+        # Мелкий шаг индекса, чтобы выборки затрагивали несколько блоков файла
+        monkeypatch.setattr(file_store, "INDEX_STRIDE", 7)
+        store = ColumnarFileStore(str(tmp_path / "store"))
+    store.prepare()
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def rows(store):
+    rows = make_rows()
+    for i in range(0, len(rows), 97):
+        store.append(rows[i:i + 97])
+    return rows
+
+
+def assert_series_equal(actual, wanted):
+    assert np.array_equal(actual['ts'], wanted['ts'])
+    assert np.allclose(actual['value'], wanted['value'])
+
+
+def test_range(store, rows):
+    start_ts, end_ts = T0 + 1000, T0 + 40000
+    for device_id in DEVICES:
+        for sensor in SENSORS:
+            assert_series_equal(store.range(sensor, start_ts, end_ts, device_id),
+                                expected(rows, device_id, sensor, start_ts, end_ts))
+
+
+def test_range_many(store, rows):
+    start_ts, end_ts = T0 + 500, T0 + 30000
+    result = store.range_many(SENSORS + ["missing"], start_ts, end_ts, "a")
+    assert set(result) == set(SENSORS + ["missing"])
+    for sensor in SENSORS:
+        assert_series_equal(result[sensor], expected(rows, "a", sensor, start_ts, end_ts))
+    assert len(result["missing"]) == 0
+
+
+def test_latest(store, rows):
+    for device_id in DEVICES:
+        for sensor in SENSORS:
+            wanted = expected(rows, device_id, sensor)[-1]
+            value, timestamp = store.latest(sensor, device_id)
+            assert value == pytest.approx(wanted['value'])
+            assert timestamp == format_timestamp(int(wanted['ts']))
+    assert store.latest("tempC", "unknown") is None
+
+
+def test_tail(store, rows):
+    for device_id in DEVICES:
+        for sensor in SENSORS:
+            assert_series_equal(store.tail(sensor, 5, device_id), expected(rows, device_id, sensor)[-5:])
+    assert len(store.tail("tempC", 5, "unknown")) == 0
+
+
+def check_aggregate(actual, series, bucket_width):
+    wanted = columnar.aggregate(series, bucket_width)
+    assert np.array_equal(actual['ts'], wanted['ts'])
+    for name in ("value", "min", "max"):
+        assert np.allclose(actual[name], wanted[name])
+
+
+@pytest.mark.parametrize("bucket_width", [60, 3600, 7200, 86400])
+def test_aggregate(store, rows, bucket_width):
+    start_ts, end_ts = T0, T0 + 86400 - 1
+    for sensor in SENSORS:
+        check_aggregate(store.aggregate(sensor, start_ts, end_ts, bucket_width, "b"),
+                        expected(rows, "b", sensor, start_ts, end_ts), bucket_width)
+
+
+def test_aggregate_many(store, rows):
+    start_ts, end_ts = T0, T0 + 7200 * 4 - 1
+    result = store.aggregate_many(SENSORS, start_ts, end_ts, 7200, "a")
+    assert set(result) == set(SENSORS)
+    for sensor in SENSORS:
+        check_aggregate(result[sensor], expected(rows, "a", sensor, start_ts, end_ts), 7200)
+
+
+def test_devices(store, rows):
+    assert sorted(store.devices()) == DEVICES
+    store.append([("c", "tempC", 1.0, rows[-1][3] + 60)])
+    assert store.devices()[0] == "c"
+
+
+def test_users(store):
+    assert store.users() == []
+    store.add_user(5)
+    store.add_user(5)
+    store.add_user(7)
+    assert sorted(store.users()) == [5, 7]
+
+
+def test_out_of_order_append(store, rows):
+    late = [(DEFAULT_DEVICE, "tempC", 1.5, T0 + 100), (DEFAULT_DEVICE, "tempC", 2.5, T0 + 40)]
+    store.append([(DEFAULT_DEVICE, "tempC", 3.5, T0 + 200)])
+    store.append(late)
+    series = store.range("tempC", T0, T0 + 1000)
+    assert list(series['ts']) == [T0 + 40, T0 + 100, T0 + 200]
+    assert list(series['value']) == [2.5, 1.5, 3.5]
+    assert list(store.tail("tempC", 2)['ts']) == [T0 + 100, T0 + 200]
+    assert store.latest("tempC")[0] == 3.5
+    check_aggregate(store.aggregate("tempC", T0, T0 + 1000, 60), series, 60)
@@ -0,0 +1,94 @@
+"""PerChatUpdateProcessor: порядок обновлений внутри чата и независимость чатов друг от друга."""
+import asyncio
+import datetime
+
+from telegram import Chat, Message, Update
+
+from updates import PerChatUpdateProcessor
+
+
+def make_update(update_id, chat_id):
+    message = Message(
+        message_id=update_id,
+        date=datetime.datetime.now(datetime.timezone.utc),
+        chat=Chat(id=chat_id, type=Chat.PRIVATE),
+        text=str(update_id),
+    )
+    return Update(update_id=update_id, message=message)
+
+
+async def process_all(processor, jobs):
+    """Отдаёт обновления процессору по одному, как Application, и ждёт завершения всех."""
+    async with processor:
+        tasks = []
+        for update, coroutine in jobs:
+            tasks.append(asyncio.create_task(processor.process_update(update, coroutine)))
+            # Application создаёт задачу на каждое обновление в порядке получения
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+
+def test_order_within_chat():
+    processor = PerChatUpdateProcessor(max_concurrent=8)
+    handled = {}
+
+    async def handler(update, delay):
+        await asyncio.sleep(delay)
+        handled.setdefault(update.effective_chat.id, []).append(update.update_id)
+
+    jobs = []
+    update_id = 0
+    for _ in range(10):
+        for chat_id in (1, 2, 3):
+            update_id += 1
+            update = make_update(update_id, chat_id)
+            # Ранние обновления медленнее поздних: без очереди чата порядок бы перевернулся
+            jobs.append((update, handler(update, 0.02 / update_id)))
+
+    asyncio.run(process_all(processor, jobs))
+
+    assert set(handled) == {1, 2, 3}
+    for chat_id, ids in handled.items():
+        assert ids == sorted(ids)
+        assert len(ids) == 10
+    assert processor.processed == 30
+    assert processor.stats()["active"] == 0
+    assert processor.stats()["chats_waiting"] == 0
+
+
+def test_slow_chat_does_not_block_others():
+    processor = PerChatUpdateProcessor(max_concurrent=4)
+    finished = []
+
+    async def scenario():
+        slow_done = asyncio.Event()
+
+        async def slow(update):
+            await slow_done.wait()
+            finished.append(update.update_id)
+
+        async def fast(update):
+            finished.append(update.update_id)
+
+        first, second = make_update(1, 100), make_update(2, 100)
+        jobs = [(first, slow(first)), (second, fast(second))]
+        for update_id, chat_id in ((3, 200), (4, 300), (5, 400)):
+            update = make_update(update_id, chat_id)
+            jobs.append((update, fast(update)))
+
+        async def watcher():
+            # Другие чаты обрабатываются, пока медленный обработчик чата 100 ещё ждёт
+            for _ in range(100):
+                if len(finished) == 3:
+                    break
+                await asyncio.sleep(0.001)
+            assert sorted(finished) == [3, 4, 5]
+            assert processor.stats()["active"] == 1
+            slow_done.set()
+
+        await asyncio.gather(process_all(processor, jobs), watcher())
+
+    asyncio.run(scenario())
+    # Второе обновление медленного чата дождалось первого
+    assert finished[3:] == [1, 2]
+    assert processor.processed == 5
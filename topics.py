@@ -0,0 +1,47 @@
+import re
+
+DEVICE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,48}$")
+# Последний сегмент топика для пакетных сообщений (payload.py)
+BATCH = "batch"
+
+
+class TopicRouter:
+    """
+    Сопоставляет MQTT-топик паре (device_id, датчик).
+
+    Новая схема топиков: sensors/<device_id>/<metric>, где metric — ключ словаря
+    metrics ("temperature" -> "tempC" и т.д.). Старые топики без device_id
+    (sensors/temperature) относятся к устройству default_device.
+    Для топика sensors/<device_id>/batch вместо датчика возвращается BATCH.
+    Разбор каждого топика выполняется один раз, дальше ответ берётся из словаря за O(1).
+    Неизвестные топики тоже запоминаются (как None), размер словаря ограничен max_routes.
+    """
+
+    def __init__(self, metrics, legacy_topics, default_device, prefix="sensors", max_routes=100000):
+        self.metrics = metrics
+        self.legacy_topics = legacy_topics
+        self.prefix = prefix
+        self.max_routes = max_routes
+        self._routes = {topic: (default_device, sensor) for sensor, topic in legacy_topics.items()}
+
+    def subscriptions(self):
+        return list(self.legacy_topics.values()) + [f"{self.prefix}/+/+"]
+
+    def _parse(self, topic):
+        parts = topic.split("/")
+        if len(parts) != 3 or parts[0] != self.prefix:
+            return None
+        sensor = BATCH if parts[2] == BATCH else self.metrics.get(parts[2])
+        if sensor is None or not DEVICE_ID_PATTERN.match(parts[1]):
+            return None
+        return parts[1], sensor
+
+    def resolve(self, topic):
+        try:
+            return self._routes[topic]
+        except KeyError:
+            pass
+        route = self._parse(topic)
+        if len(self._routes) < self.max_routes:
+            self._routes[topic] = route
+        return route
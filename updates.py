@@ -0,0 +1,72 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений Telegram с сохранением порядка внутри чата.
+
+    Обновления разных чатов обрабатываются одновременно, не больше max_concurrent
+    за раз; обновления одного чата — строго по очереди, в порядке поступления.
+    Ожидание своей очереди в чате не занимает слот max_concurrent, поэтому
+    пользователь, нажавший кнопку много раз подряд, не задерживает остальные чаты.
+    max_pending ограничивает общее число принятых, но ещё не обработанных обновлений.
+    """
+
+    def __init__(self, max_concurrent=64, max_pending=10000):
+        super().__init__(max_pending)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._chats = {}
+        # Обновления, которые сейчас обрабатываются (заняли слот max_concurrent)
+        self.active = 0
+        self.processed = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def chat_key(update):
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.chat_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+        # Очередь чата: блокировка и число ожидающих её обновлений
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[key]
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self.active += 1
+            try:
+                await coroutine
+            finally:
+                self.active -= 1
+        self.processed += 1
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "chats_waiting": len(self._chats),
+            "processed": self.processed,
+        }
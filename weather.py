@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import metrics
+
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
+
+
+class WeatherProvider:
+    """
+    Асинхронный источник внешней температуры (по умолчанию Open-Meteo).
+
+    Значения кэшируются по координатам на ttl секунд. Устаревшее значение отдаётся
+    сразу, а обновление идёт в фоне; при ошибке запроса продолжает отдаваться
+    последнее известное значение. Если значения ещё нет и запрос не удался,
+    возвращается None.
+
+    После неудачного запроса новая попытка делается не раньше чем через retry_interval секунд.
+
+    base_url и transport позволяют направить запросы на локальный сервер-заглушку
+    (или httpx.MockTransport) в тестах.
+    """
+
+    def __init__(self, base_url=OPEN_METEO_URL, ttl=600, timeout=10.0, retry_interval=60,
+                 transport=None):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.transport = transport
+        self._client = None
+        self._cache = {}
+        self._inflight = {}
+        self._retry_at = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _get_client(self):
+        if self._client is None:
+            # httpx загружается при первом запросе погоды, а не при старте бота
+            import httpx
+            self._client = httpx.AsyncClient(timeout=self.timeout, transport=self.transport)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @metrics.timed(metrics.WEATHER_SECONDS, errors=metrics.WEATHER_ERRORS, call="api")
+    async def _fetch(self, latitude, longitude):
+        response = await self._get_client().get(self.base_url, params={
+            "latitude": latitude,
+            "longitude": longitude,
+            "current_weather": "true",
+        })
+        response.raise_for_status()
+        return float(response.json()["current_weather"]["temperature"])
+
+    async def _refresh(self, key):
+        try:
+            value = await self._fetch(*key)
+        except Exception as e:
+            self.errors += 1
+            self._retry_at[key] = time.monotonic() + self.retry_interval
+            print("Ошибка получения данных погоды:", e)
+            return None
+        self._cache[key] = (value, time.monotonic())
+        self._retry_at.pop(key, None)
+        return value
+
+    def _can_retry(self, key):
+        return time.monotonic() >= self._retry_at.get(key, 0.0)
+
+    def _refresh_once(self, key):
+        """Не даёт запустить несколько одновременных запросов по одним координатам."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def get_temperature(self, latitude, longitude):
+        key = (round(latitude, 4), round(longitude, 4))
+        entry = self._cache.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            self.hits += 1
+            if time.monotonic() - fetched_at >= self.ttl and self._can_retry(key):
+                self._refresh_once(key)
+            return value
+        self.misses += 1
+        if not self._can_retry(key):
+            return None
+        return await asyncio.shield(self._refresh_once(key))
+
+    def stats(self):
+        return {
+            "entries": len(self._cache),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+    async def refresh_all(self):
+        """Обновляет все закэшированные координаты; вызывается периодически из job_queue."""
+        if self._cache:
+            await asyncio.gather(*(self._refresh_once(key) for key in list(self._cache)))
@@ -0,0 +1,64 @@
+import threading
+from collections import deque
+
+from schema import format_timestamp, DEFAULT_DEVICE
+
+
+class LatestWindows:
+    """
+    Кольцевые буферы последних показаний по каждой паре (устройство, датчик).
+
+    Заполняются прямо из MQTT-обработчика и один раз прогреваются из хранилища при старте,
+    так что детекторы перепадов и "Текущие показания" обходятся без запросов к хранилищу.
+    Запись идёт из потока MQTT, чтение — из цикла событий бота, поэтому доступ
+    защищён блокировкой.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def _buffer(self, key):
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = deque(maxlen=self.size)
+        return buffer
+
+    def push(self, sensor, value, ts, device_id=DEFAULT_DEVICE):
+        with self._lock:
+            self._buffer((device_id, sensor)).append((ts, value))
+
+    def latest(self, sensor, device_id=DEFAULT_DEVICE):
+        """Последнее показание в формате get_current_data: (value, timestamp) или None."""
+        with self._lock:
+            buffer = self._buffers.get((device_id, sensor))
+            if not buffer:
+                return None
+            ts, value = buffer[-1]
+        return value, format_timestamp(ts)
+
+    def values(self, sensor, n, device_id=DEFAULT_DEVICE):
+        """До n последних значений, начиная с самого свежего."""
+        with self._lock:
+            buffer = self._buffers.get((device_id, sensor))
+            if not buffer:
+                return []
+            n = min(n, len(buffer))
+            return [buffer[-i][1] for i in range(1, n + 1)]
+
+    def keys(self):
+        with self._lock:
+            return list(self._buffers)
+
+    def warm(self, store, sensors):
+        """Загружает хвост истории всех известных устройств из хранилища; вызывается до подключения к MQTT."""
+        for device_id in store.devices():
+            for sensor in sensors:
+                series = store.tail(sensor, self.size, device_id)
+                if not len(series):
+                    continue
+                with self._lock:
+                    buffer = self._buffer((device_id, sensor))
+                    buffer.clear()
+                    buffer.extend(zip(series['ts'].tolist(), series['value'].tolist()))
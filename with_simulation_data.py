@@ -1,10 +1,9 @@
-import os
-import sqlite3
 import random
 import datetime
-import textwrap
-import matplotlib.pyplot as plt
 import requests  # для работы с API погоды
+import schema
+import render
+from sensor_store import SqliteSensorStore
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes
@@ -12,6 +11,7 @@ from telegram.ext import (
 
 # Файл БД SQLite
 DB_FILE = 'sensor_data.db'
+STORE = SqliteSensorStore(DB_FILE)
 
 # Глобальные переменные для симуляции и уведомлений
 simulation_counter = 0
@@ -22,34 +22,22 @@ SPIKE_THRESHOLD = 2.0  # Минимальное изменение для вну
 
 # Функции работы с БД
 def check_and_create_db():
-    """Проверяет наличие БД и создаёт таблицу, если её нет."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sensor_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sensor TEXT,
-            value REAL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    """Проверяет наличие БД и приводит схему к актуальной версии."""
+    STORE.prepare()
+
+
+def insert_reading(sensor, value, timestamp=None):
+    """Записывает показание с текстовой и целочисленной (ts) меткой времени."""
+    if timestamp is None:
+        timestamp = datetime.datetime.now().strftime(schema.TIMESTAMP_FORMAT)
+    STORE.append([(schema.DEFAULT_DEVICE, sensor, value, schema.to_epoch(timestamp))])
 
 
 def simulate_temp_data(timestamp=None):
     """Генерация нормальной температуры в комнате (18-25 °C).
        Заменить датчиком!!!"""
     temp = random.uniform(18, 25)
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    if timestamp:
-        c.execute("INSERT INTO sensor_data (sensor, value, timestamp) VALUES (?, ?, ?)",
-                  ("tempC", temp, timestamp))
-    else:
-        c.execute("INSERT INTO sensor_data (sensor, value) VALUES (?, ?)", ("tempC", temp))
-    conn.commit()
-    conn.close()
+    insert_reading("tempC", temp, timestamp)
     return temp
 
 
@@ -57,15 +45,7 @@ def simulate_humidity_data(timestamp=None):
     """Генерация нормальной влажности в комнате (30-60 %).
        Заменить датчиком!!!"""
     humidity = random.uniform(30, 60)
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    if timestamp:
-        c.execute("INSERT INTO sensor_data (sensor, value, timestamp) VALUES (?, ?, ?)",
-                  ("Humidity", humidity, timestamp))
-    else:
-        c.execute("INSERT INTO sensor_data (sensor, value) VALUES (?, ?)", ("Humidity", humidity))
-    conn.commit()
-    conn.close()
+    insert_reading("Humidity", humidity, timestamp)
     return humidity
 
 
@@ -73,99 +53,39 @@ def simulate_q_data(timestamp=None):
     """Генерация нормального теплового потока на улице (0-50 условных единиц).
        Заменить датчиком!!!"""
     q_value = random.uniform(0, 50)
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    if timestamp:
-        c.execute("INSERT INTO sensor_data (sensor, value, timestamp) VALUES (?, ?, ?)",
-                  ("q", q_value, timestamp))
-    else:
-        c.execute("INSERT INTO sensor_data (sensor, value) VALUES (?, ?)", ("q", q_value))
-    conn.commit()
-    conn.close()
+    insert_reading("q", q_value, timestamp)
     return q_value
 
 
 def get_current_data(sensor):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT value, timestamp FROM sensor_data WHERE sensor=? ORDER BY timestamp DESC LIMIT 1", (sensor,))
-    result = c.fetchone()
-    conn.close()
-    return result
+    return STORE.latest(sensor)
 
 
 def get_data_period(sensor, start_time, end_time):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        SELECT value, timestamp FROM sensor_data 
-        WHERE sensor=? AND timestamp BETWEEN ? AND ? 
-        ORDER BY timestamp
-    ''', (sensor, start_time, end_time))
-    result = c.fetchall()
-    conn.close()
-    return result
+    series = get_data_period_array(sensor, start_time, end_time)
+    return [(value, schema.format_timestamp(ts)) for ts, value in series.tolist()]
+
+
+def get_data_period_array(sensor, start_time, end_time):
+    """То же, что get_data_period, но в виде массива NumPy (ts, value) для графиков."""
+    return STORE.range(sensor, schema.to_epoch(start_time), schema.to_epoch(end_time))
 
 
 def generate_graph(data, sensor):
-    """Генерирует график изменения показаний датчика"""
-    if not data:
-        return None
-    values = [row[0] for row in data]
-    timestamps = [datetime.datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S") for row in data]
-    plt.figure(figsize=(10, 5))
-    plt.plot(timestamps, values, marker='o')
-    plt.title(f'Изменение показаний {sensor}')
-    plt.xlabel('Время')
-    plt.ylabel('Значение')
-    plt.grid(True)
-    graph_file = f'{sensor}_graph.png'
-    plt.savefig(graph_file)
-    plt.close()
-    return graph_file
+    """Генерирует график изменения показаний датчика, возвращает PNG в виде bytes"""
+    return render.render_graph(data, sensor)
 
 
 def generate_alert_graph(sensor, period_minutes, alert_message):
     """
     Генерирует график за указанный период с аннотацией,
     выделяющей последний измеренный показатель и выводящей сообщение об аномалии.
+    Возвращает PNG в виде bytes.
     """
     end_time = datetime.datetime.now()
     start_time = end_time - datetime.timedelta(minutes=period_minutes)
-    data = get_data_period(sensor, start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                           end_time.strftime("%Y-%m-%d %H:%M:%S"))
-    if not data:
-        return None
-
-    values = [row[0] for row in data]
-    timestamps = [datetime.datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S") for row in data]
-
-    plt.figure(figsize=(10, 5))
-    plt.plot(timestamps, values, marker='o', linestyle='-', label=sensor)
-    plt.title(f'Изменение показаний {sensor} с обнаруженным перепадом')
-    plt.xlabel('Время')
-    plt.ylabel('Значение')
-    plt.grid(True)
-    wrapped_message = textwrap.fill(alert_message, width=30)
-
-
-    plt.annotate(
-        wrapped_message,
-        xy=(timestamps[-1], values[-1]),
-        xycoords='data',
-        xytext=(-150, 20),
-        textcoords='offset points',
-        arrowprops=dict(facecolor='red', shrink=0.05),
-        fontsize=12,
-        color='red',
-        ha='right'
-    )
-
-    plt.legend()
-    alert_graph_file = f'{sensor}_alert_graph.png'
-    plt.savefig(alert_graph_file)
-    plt.close()
-    return alert_graph_file
+    data = get_data_period_array(sensor, start_time, end_time)
+    return render.render_alert_graph(data, sensor, alert_message)
 
 
 def get_weather_novosibirsk():
@@ -203,15 +123,11 @@ def check_internal_temperature_alert(threshold=SPIKE_THRESHOLD, margin=5.0):
       (alert_flag, abs_diff, direction, internal_current, external_temp)
       где direction = "increase" или "decrease", если аномалия обнаружена, иначе None.
     """
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT value FROM sensor_data WHERE sensor='q' ORDER BY timestamp DESC LIMIT 5")
-    rows = c.fetchall()
-    conn.close()
-    if len(rows) < 2:
+    values = STORE.tail('q', 5)['value'][::-1].tolist()
+    if len(values) < 2:
         return False, None, None, None, None
-    internal_current = rows[0][0]
-    previous_values = [row[0] for row in rows[1:]]
+    internal_current = values[0]
+    previous_values = values[1:]
     avg_previous = sum(previous_values) / len(previous_values)
     diff_internal = internal_current - avg_previous
     abs_diff = abs(diff_internal)
@@ -232,15 +148,11 @@ def check_thermal_flow_spike(threshold=10.0):
 
     Возвращает (True, diff) если разница (с учётом направления) превышает порог, иначе (False, diff).
     """
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT value FROM sensor_data WHERE sensor='tempC' ORDER BY timestamp DESC LIMIT 5")
-    rows = c.fetchall()
-    conn.close()
-    if len(rows) < 2:
+    values = STORE.tail('tempC', 5)['value'][::-1].tolist()
+    if len(values) < 2:
         return False, None
-    current = rows[0][0]
-    previous_values = [row[0] for row in rows[1:]]
+    current = values[0]
+    previous_values = values[1:]
     avg_previous = sum(previous_values) / len(previous_values)
     diff = current - avg_previous
     if abs(diff) > threshold:
@@ -297,12 +209,7 @@ async def sensor_simulation_job(context: ContextTypes.DEFAULT_TYPE):
     # Для температуры: каждые две итерации генерируем скачок
     if simulation_counter % 2 == 0:
         temp_spike = random.uniform(30, 35)
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("INSERT INTO sensor_data (sensor, value, timestamp) VALUES (?, ?, ?)",
-                  ("tempC", temp_spike, timestamp_str))
-        conn.commit()
-        conn.close()
+        insert_reading("tempC", temp_spike, timestamp_str)
     else:
         simulate_temp_data(timestamp_str)
 
@@ -317,13 +224,13 @@ async def sensor_simulation_job(context: ContextTypes.DEFAULT_TYPE):
         # Генерируем график с аннотацией для внутренних показаний, если перепад внутренней температуры обнаружен
         if "внутренней температуры" in message:
             alert_graph = generate_alert_graph("tempC", 60, message)
-            if alert_graph and os.path.exists(alert_graph):
-                await context.bot.send_photo(chat_id=ADMIN_CHAT_ID, photo=open(alert_graph, 'rb'))
+            if alert_graph:
+                await context.bot.send_photo(chat_id=ADMIN_CHAT_ID, photo=alert_graph)
         # Если перепад обнаружен по тепловому потоку, генерируем график для него
         if "теплового потока" in message:
             alert_graph = generate_alert_graph("q", 60, message)
-            if alert_graph and os.path.exists(alert_graph):
-                await context.bot.send_photo(chat_id=ADMIN_CHAT_ID, photo=open(alert_graph, 'rb'))
+            if alert_graph:
+                await context.bot.send_photo(chat_id=ADMIN_CHAT_ID, photo=alert_graph)
 
 
 # Функции формирования меню
@@ -414,14 +321,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 sensor_name = "Влажность (в комнате)"
             elif sensor == 'q':
                 sensor_name = "Тепловой поток (на улице)"
-            data_records = get_data_period(sensor, start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                                           end_time.strftime("%Y-%m-%d %H:%M:%S"))
-            if data_records:
-                graph_file = generate_graph(data_records, sensor)
+            data_records = get_data_period_array(sensor, start_time, end_time)
+            if len(data_records):
+                graph = generate_graph(data_records, sensor)
                 messages.append(f"Данные за выбранный период для {sensor_name}:")
-                if graph_file and os.path.exists(graph_file):
+                if graph:
                     await context.bot.send_photo(chat_id=update.effective_chat.id,
-                                                 photo=open(graph_file, 'rb'))
+                                                 photo=graph)
             else:
                 messages.append(f"Нет данных для {sensor_name} за выбранный период.")
         await query.edit_message_text(text="\n".join(messages))
@@ -435,12 +341,12 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Если аномалия обнаружена, выводим график для соответствующего датчика
             if "внутренней температуры" in message:
                 alert_graph = generate_alert_graph("tempC", 60, message)
-                if alert_graph and os.path.exists(alert_graph):
-                    await context.bot.send_photo(chat_id=update.effective_chat.id, photo=open(alert_graph, 'rb'))
+                if alert_graph:
+                    await context.bot.send_photo(chat_id=update.effective_chat.id, photo=alert_graph)
             if "теплового потока" in message:
                 alert_graph = generate_alert_graph("q", 60, message)
-                if alert_graph and os.path.exists(alert_graph):
-                    await context.bot.send_photo(chat_id=update.effective_chat.id, photo=open(alert_graph, 'rb'))
+                if alert_graph:
+                    await context.bot.send_photo(chat_id=update.effective_chat.id, photo=alert_graph)
         else:
             text = "Резкий перепад не обнаружен или данных недостаточно."
             await query.edit_message_text(text=text)